@@ -0,0 +1,299 @@
+#!/usr/local/bin/python3.8
+"""
+Benchmarks for the controller, using in-memory fake decks.
+
+Measures cold and warm page render times, press-to-pixel latency and
+update throughput for the Mini, Original and XL key layouts. Run it
+before and after every performance change:
+
+    ./benchmark.py --latency 0.002 --json results.json
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import logging
+import pathlib
+import statistics
+import tempfile
+import time
+
+from typing import Dict, List
+
+from PIL import Image
+
+import tracing
+from controller import Controller
+from fakedeck import FakeStreamDeck
+from framescheduler import Priority
+from pages.base import Page
+from pages.commands import BackAction
+from pages.diskcache import DiskCache
+from pages.render import load_font, set_disk_cache, set_render_pool
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+ICONS = ("bench-a.png", "bench-b.png", "bench-c.png", "bench-d.png")
+COLOURS = ("red", "green", "blue", "orange")
+
+
+class BenchmarkPage(Page):
+    """
+    Page that fills every key of the deck with an icon and a label.
+
+    Pressing the first key opens the target page.
+    """
+    label_prefix = "Key"
+
+    async def render(self):
+        count = self.controller.deck.key_count()
+        return await asyncio.gather(*(
+            self.render_image_from_file(
+                ICONS[i % len(ICONS)],
+                f"{self.label_prefix} {i}"
+            )
+            for i in range(count)
+        ))
+
+    async def button_1(self):
+        await self.controller.set_next_page(BenchmarkTargetPage)
+
+
+class BenchmarkTargetPage(BenchmarkPage):
+    """
+    Navigation target of the benchmark page, every key differs from it.
+    """
+    label_prefix = "Target"
+
+    button_1 = BackAction()
+
+
+def create_assets(path: pathlib.Path):
+    """
+    Create the icons used by the benchmark pages.
+
+    No font is created, so labels use the default font unless the
+    asset directory already has one.
+    """
+    icons = path / "icons"
+    icons.mkdir(parents=True, exist_ok=True)
+    for icon, colour in zip(ICONS, COLOURS):
+        Image.new("RGBA", (256, 256), colour).save(icons / icon)
+
+
+def clear_memory_caches():
+    Page._render_key_image.cache_clear()
+    load_font.cache_clear()
+
+
+def summarise(samples: List[float]) -> Dict[str, float]:
+    """
+    Summary statistics of timing samples, in milliseconds.
+    """
+    samples = sorted(samples)
+    n = len(samples)
+    return {
+        "n": n,
+        "mean_ms": 1000 * statistics.mean(samples),
+        "p50_ms": 1000 * samples[n // 2],
+        "p95_ms": 1000 * samples[min(n - 1, int(n * 0.95))],
+        "max_ms": 1000 * samples[-1],
+    }
+
+
+async def time_render(controller: Controller, iterations: int,
+                      cold: bool, cache_dir: pathlib.Path) -> List[float]:
+    """
+    Time to render the page and queue it, without the frame window.
+    """
+    samples = []
+    for i in range(iterations):
+        if cold:
+            set_disk_cache(DiskCache(cache_dir / f"cold-{i}"))
+            clear_memory_caches()
+        start = time.perf_counter()
+        await controller.update_deck(Priority.Input)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def time_press_to_pixel(controller: Controller,
+                              deck: FakeStreamDeck,
+                              iterations: int) -> List[float]:
+    """
+    Time from pressing a navigation key until the new page is shown.
+    """
+    loop = asyncio.get_running_loop()
+    count = deck.key_count()
+    samples = []
+    for _ in range(iterations):
+        # Alternates between the benchmark page and its target page
+        start = time.perf_counter()
+        await deck.press(0)
+        end = await loop.run_in_executor(
+            None, deck.wait_for_writes, count, start, 10.0
+        )
+        if end is None:
+            LOGGER.warning("Timed out waiting for the deck to update")
+            continue
+        samples.append(end - start)
+    return samples
+
+
+async def time_updates(controller: Controller, deck: FakeStreamDeck,
+                       duration: float) -> Dict[str, float]:
+    """
+    Rate at which single key updates are accepted and written.
+    """
+    images = await asyncio.gather(
+        controller.default_page.render_image_from_file(ICONS[0], "A"),
+        controller.default_page.render_image_from_file(ICONS[1], "B"),
+    )
+
+    writes_before = len(deck.writes)
+    requests = 0
+    start = time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < duration:
+        await controller.update_key(0, images[requests % 2], Priority.Input)
+        requests += 1
+
+    # Let the writer finish what was accepted
+    await asyncio.sleep(0.1 + deck.latency)
+    writes = len(deck.writes) - writes_before
+    return {
+        "requests_per_s": requests / elapsed,
+        "writes_per_s": writes / elapsed,
+    }
+
+
+async def benchmark_layout(layout: str, args, cache_dir: pathlib.Path):
+    deck = FakeStreamDeck(layout, latency=args.latency)
+    deck.open()
+    deck.reset()
+
+    controller = Controller(deck, main_page=BenchmarkPage)
+    deck.set_key_callback_async(controller)
+    await controller.setup()
+
+    results = {}
+    try:
+        results["cold_render"] = summarise(await time_render(
+            controller, args.iterations, True, cache_dir
+        ))
+
+        # Render once into the disk cache, then time a render that
+        # can only be served from it
+        set_disk_cache(DiskCache(cache_dir / "warm"))
+        clear_memory_caches()
+        await controller.update_deck(Priority.Input)
+        clear_memory_caches()
+        start = time.perf_counter()
+        await controller.update_deck(Priority.Input)
+        results["disk_render"] = summarise([time.perf_counter() - start])
+
+        results["warm_render"] = summarise(await time_render(
+            controller, args.iterations, False, cache_dir
+        ))
+        results["press_to_pixel"] = summarise(await time_press_to_pixel(
+            controller, deck, args.iterations
+        ))
+        results["updates"] = await time_updates(
+            controller, deck, args.duration
+        )
+    finally:
+        controller.shutdown()
+        set_disk_cache(None)
+    return results
+
+
+def print_results(results):
+    for layout, layout_results in results.items():
+        print(f"{layout}:")
+        for name, values in layout_results.items():
+            summary = ", ".join(f"{k}={v:.2f}" for k, v in values.items())
+            print(f"  {name:<16} {summary}")
+
+
+async def main(args):
+    # The disk caches the benchmark sets only apply in this process,
+    # so render in threads even if a process pool is configured
+    set_render_pool(concurrent.futures.ThreadPoolExecutor(thread_name_prefix="render"))
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_path = pathlib.Path(tmp)
+        if args.assets is None:
+            create_assets(tmp_path / "assets")
+            Page.asset_path = tmp_path / "assets"
+        else:
+            Page.asset_path = args.assets
+
+        for layout in args.layout:
+            results[layout] = await benchmark_layout(
+                layout, args, tmp_path / "cache" / layout
+            )
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "-l", "--layout",
+        action="append",
+        choices=["mini", "original", "xl"],
+        help="Deck layout to benchmark, may be given more than once. "
+             "Defaults to all layouts"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Simulated USB latency of each key write, in seconds"
+    )
+    parser.add_argument(
+        "-n", "--iterations",
+        type=int,
+        default=20,
+        help="Number of samples for each timing"
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=1.0,
+        help="Duration of the update throughput test, in seconds"
+    )
+    parser.add_argument(
+        "--assets",
+        type=pathlib.Path,
+        help="Asset directory to use instead of generated icons"
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Enable tracing and print the latency histograms"
+    )
+    parser.add_argument(
+        "--json",
+        type=pathlib.Path,
+        help="Also write the results to this file as JSON"
+    )
+    args = parser.parse_args(argv)
+    args.layout = args.layout or ["mini", "original", "xl"]
+    return args
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+
+    args = parse_args()
+    if args.trace:
+        tracing.enable()
+    results = asyncio.run(main(args))
+    print_results(results)
+    if args.trace:
+        print(tracing.STATS.dump())
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
@@ -6,10 +6,16 @@ import time
 import traceback
 import inspect
 
-from typing import List, Union
+from collections import defaultdict
+from typing import (Awaitable, Callable, DefaultDict, Dict, Iterable, List,
+                    Optional, Set, Type, Union)
 
 from StreamDeck.Devices.StreamDeck import StreamDeck
-from pages import get_page, MainPage, Page
+import tracing
+from deckwriter import DeckWriter
+from framescheduler import FrameScheduler, Priority, UPDATE_PRIORITY
+from pages import get_page, load_page, Page
+from pages.pagecache import PageCache
 from pages.pagestack import PageStack, PageState
 
 
@@ -18,114 +24,419 @@ LOGGER = logging.getLogger(__name__)
 
 class Controller:
 
-    def __init__(self, deck: StreamDeck, main_page=MainPage, loop=None):
-        self.page_cache = {}        
+    # Update requests arriving within this many seconds of each other
+    # are combined into a single render and flush.
+    frame_window: float = 0.01
+
+    # Seconds after a page is shown before the pages it navigates to
+    # are prerendered, so prerendering does not compete with presses
+    prerender_delay: float = 0.1
+
+    # Budget of the page cache. Pages that are not on the stack are
+    # evicted, least recently used first, when there are more pages
+    # than this or they use more bytes of cached images.
+    page_cache_size: Optional[int] = 16
+    page_cache_bytes: Optional[int] = 8 * 1024 * 1024
+
+    def __init__(self, deck: StreamDeck,
+                 main_page: Union[str, Type[Page]] = "MainPage", loop=None):
+        self.page_cache = PageCache(
+            self.page_cache_size,
+            self.page_cache_bytes,
+            pinned=lambda page: (
+                self.page_stack.get_status(page) is not PageState.Inactive
+            )
+        )
         self.loop = loop or asyncio.get_event_loop()
         self.deck = deck
+        self.attached = True
 
-        self._lock = asyncio.Lock()
+        # USB writes happen on a dedicated thread so they never block
+        # the event loop.
+        self._writer = DeckWriter(deck)
+        self._writer.start()
 
+        self._scheduler = FrameScheduler(
+            self._render_current,
+            self._flush,
+            self.frame_window,
+            self._render_current_keys
+        )
+
+        if isinstance(main_page, str):
+            # Only the module of the root page is imported up front
+            main_page = load_page(main_page)
         page = main_page(self)
         self.default_page = page
         self.current_page = page
         self.previous_page = None
-        self.page_cache["MainPage"] = page
+        self.page_cache[main_page.__name__] = page
 
         self.page_stack = PageStack(page)
 
         self.current_heartbeat_task = None
 
-    async def set_next_page(self, page):
+        # Background connect tasks of the pages
+        self._connect_tasks: Dict[Page, asyncio.Task] = {}
+
+        # Pages being created, by name
+        self._creating: Dict[str, asyncio.Future] = {}
+        # Pages each page class has navigated to, by class name
+        self._learned_targets: DefaultDict[str, Set[str]] = defaultdict(set)
+        self._prerender_task: Optional[asyncio.Task] = None
+
+    async def _get_page(self, page) -> Optional[Page]:
+        """
+        Get the cached instance of a page, given its class or name,
+        creating and setting it up if it is not cached.
+
+        Concurrent requests for the same page, such as a press and a
+        prerender, share one instance.
+        """
+        name = page.__name__ if inspect.isclass(page) else page
+        if name in self.page_cache:
+            LOGGER.info(f"Loading cached paged {name}")
+            return self.page_cache[name]
+
+        if (future := self._creating.get(name)) is None:
+            future = self._creating[name] = asyncio.ensure_future(
+                self._create_page(name, page)
+            )
+            future.add_done_callback(lambda _: self._creating.pop(name, None))
+        return await asyncio.shield(future)
+
+    async def _create_page(self, name: str, page) -> Optional[Page]:
         if inspect.isclass(page) and issubclass(page, Page):
-            if (name:=page.__name__) in self.page_cache:
-                LOGGER.info(f"Loading cached paged {name}")
-                new_page = self.page_cache[name]
-            else:
-                LOGGER.info(f"Loading new page {name}")
-                new_page = self.page_cache[name] = page(self)
-        elif page in self.page_cache:
-            LOGGER.info(f"Loading cached paged {page}")
-            new_page = self.page_cache[page]
-        elif (page_class:=await get_page(page)) is not None:
-            new_page = self.page_cache[page] = page_class(self)
-        else:
+            page_class = page
+        elif (page_class := await get_page(page)) is None:
+            return None
+
+        LOGGER.info(f"Loading new page {name}")
+        new_page = page_class(self)
+        await new_page.setup()
+        # Only cache the page once it is set up, until then the future
+        # in _creating hands it out
+        self.page_cache[name] = new_page
+        return new_page
+
+    async def set_next_page(self, page):
+        if (new_page := await self._get_page(page)) is None:
             LOGGER.warning("Page not found, no change will occur")
             return
 
+        # Remember where each page navigates to, so the targets can
+        # be prerendered the next time the page is shown
+        source = self.page_stack.current_page()
+        self._learned_targets[type(source).__name__].add(
+            page.__name__ if inspect.isclass(page) else page
+        )
+
         LOGGER.info(f"Setting page {new_page}")
-        await self.page_stack.push(new_page)
-        await self.update_deck()
+        await self._transition(new_page, lambda: self.page_stack.push(new_page))
+        self.connect_page(new_page)
+        await self.evict_pages()
+        self.schedule_prerender()
 
     async def return_to_root(self):
         """
         Return to the root page.
         """
-        await self.page_stack.pop_all()
-        await self.update_deck()
+        root = self.page_stack.pages[0]
+        await self._transition(root, self.page_stack.pop_all)
+        await self.evict_pages()
+        self.schedule_prerender()
 
     async def return_to_previous_page(self):
-        await self.page_stack.pop()
-        await self.update_deck()
-
-    async def update_deck(self):
-        deck = self.deck
-        LOGGER.info(f"Updating deck {deck.id()}")
-        async with self._lock:
-            LOGGER.debug(f"Rendering page {self.current_page}")
-            current = await self.page_stack.current_page()
-            images = await current.render()
-            LOGGER.debug(f"Setting images")
-            for i, image in enumerate(images):
-                await self._set_image(i, image)
+        pages = self.page_stack.pages
+        previous = pages[-2] if len(pages) > 1 else pages[-1]
+        await self._transition(previous, self.page_stack.pop)
+        await self.evict_pages()
+        self.schedule_prerender()
+
+    async def _transition(self, page: Page, change: Callable[[], Awaitable[None]]):
+        """
+        Change the page stack to show a page, and display it.
+
+        The page is rendered off-screen first, while the old page stays
+        active, so presses and updates keep going to the page that is
+        displayed. The stack change and the frame of the new page are
+        then committed together, and the frame replaces any updates
+        still pending for the old page.
+        """
+        with tracing.span("render"):
+            images = await page.render()
+
+        # Changing the stack never suspends, so nothing can run
+        # between the change and the commit of the frame
+        await change()
+        if self.page_stack.current_page() is page:
+            future = self._scheduler.request(frame=images)
+        else:
+            # The stack changed while rendering, show what is active now
+            future = self._scheduler.request(full=True)
+        await future
+
+    async def evict_pages(self):
+        """
+        Evict pages from the page cache until it is within budget.
+
+        Evicted pages are cleaned up and their cached images released,
+        a page navigated to again afterwards is created afresh.
+        """
+        for page in self.page_cache.evict():
+            if (task := self._connect_tasks.pop(page, None)) is not None:
+                task.cancel()
+            try:
+                await page.clean_up()
+            except Exception:
+                LOGGER.exception(f"Failed to clean up page {page}")
+            page.release_images()
+
+    async def update_deck(self, priority: Optional[Priority] = None):
+        """
+        Render the active page and update the deck.
+
+        Updates requested within the same frame window are combined
+        into a single render. The priority defaults to input priority
+        while a key press is being dispatched, and background otherwise.
+        """
+        LOGGER.info(f"Updating deck {self.deck.id()}")
+        await self._scheduler.request(full=True, priority=priority)
 
     async def maybe_update_deck(self, page):
         """
         Trigger an update of the deck if the requesting page
         is active.
         """
-        status = await self.page_stack.get_status(page)
+        status = self.page_stack.get_status(page)
         if status == PageState.Active:
-            self.update_deck()
+            await self.update_deck()
 
-    async def update_key(self, key, image):
+    async def update_key(self, key, image, priority: Optional[Priority] = None):
         """
         Update the image on a given key.
         """
-        async with self._lock:
-            await self._set_image(key, image)
+        await self._scheduler.request(keys={key: image}, priority=priority)
+
+    async def update_keys(self, keys: Iterable[int],
+                          priority: Optional[Priority] = None):
+        """
+        Re-render the given keys of the active page and update them.
+        """
+        await self._scheduler.request(dirty=keys, priority=priority)
+
+    async def maybe_update_keys(self, page, keys: Iterable[int]):
+        """
+        Re-render and update the given keys if the requesting page
+        is active.
+        """
+        status = self.page_stack.get_status(page)
+        if status == PageState.Active:
+            await self.update_keys(keys)
 
     async def maybe_update_key(self, page, key, image):
         """
         Trigger an update of a given key if the requesting page
         is active.
         """
-        status = await self.page_stack.get_status(page)
+        status = self.page_stack.get_status(page)
         if status == PageState.Active:
             await self.update_key(key, image)
 
-    async def _set_image(self, button: int, image):
+    async def _render_current(self) -> List[bytes]:
+        current = self.page_stack.current_page()
+        LOGGER.debug(f"Rendering page {current}")
+        return await current.render()
+
+    async def _render_current_keys(self, keys: Set[int]) -> Dict[int, bytes]:
+        current = self.page_stack.current_page()
+        LOGGER.debug(f"Rendering keys {sorted(keys)} of page {current}")
+        return await current.render_keys(keys)
+
+    def _flush(self, images: Dict[int, bytes], priority: Priority,
+               trace: Optional[tracing.FrameTrace] = None):
+        """
+        Queue the images of a frame to be set on the deck.
+
+        This returns as soon as the images are queued. Keys that are
+        already displaying their image are not written.
+        """
+        if not self.attached:
+            # The deck is unplugged, it is repainted when reattached
+            return
+        LOGGER.debug(f"Setting images")
+        self._writer.submit_many(images, priority, trace)
+
+    def invalidate_framebuffer(self):
+        """
+        Forget the images sent to the deck.
+
+        This must be called whenever the deck is reset, since the
+        keys no longer show what the framebuffer records.
+        """
+        self._writer.invalidate()
+
+    def attach(self, deck: StreamDeck):
+        """
+        Take control of a deck that was plugged back in.
+
+        The pages, their state and the render caches are kept from
+        before the deck was unplugged, so the current page can be
+        painted again straight away. The deck must already be open.
+        """
+        if self.attached:
+            self.detach()
+
+        self.deck = deck
+        self._writer = DeckWriter(deck)
+        self._writer.start()
+        self.attached = True
+
+    def detach(self):
+        """
+        Stop controlling a deck that was unplugged.
+
+        Pages keep running while the deck is away, their updates are
+        dropped until the deck is attached again.
+        """
+        self.attached = False
+        self._writer.stop()
+        try:
+            self.deck.close()
+        except Exception as e:
+            LOGGER.debug(f"Closing unplugged deck {self.deck.id()}: {e}")
+
+    def connect_page(self, page: Page):
         """
-        Set the image on a button of the deck.
+        Start connecting a page to its services in the background.
+
+        Each page is connected once, so this does nothing for a page
+        that is already connected or connecting.
         """
-        self.deck.set_key_image(button, image)
+        if page not in self._connect_tasks:
+            self._connect_tasks[page] = asyncio.ensure_future(
+                self._connect(page)
+            )
+
+    async def _connect(self, page: Page):
+        try:
+            await page.connect()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Nothing awaits the connect task, log failures here
+            LOGGER.exception(f"Failed to connect page {page}")
 
     async def setup(self):
+        """
+        Set up the root page.
+
+        This only sets up the state of the page, so the deck can be
+        painted straight away. Call start once the deck is painted to
+        connect the page to its services.
+        """
         await self.current_page.setup()
 
+    def start(self):
+        """
+        Connect the root page in the background.
+        """
+        self.connect_page(self.current_page)
+        self.schedule_prerender()
+
+    def navigation_targets(self, page: Page) -> List[str]:
+        """
+        Get the names of the pages a page is expected to navigate to.
+
+        These are the targets the page declares and the pages it has
+        navigated to before.
+        """
+        targets = list(page.navigation_targets)
+        for name in sorted(self._learned_targets.get(type(page).__name__, ())):
+            if name not in targets:
+                targets.append(name)
+        return targets
+
+    def schedule_prerender(self):
+        """
+        Prerender the navigation targets of the active page once the
+        deck is idle, replacing any prerender already scheduled.
+        """
+        if self._prerender_task is not None:
+            self._prerender_task.cancel()
+        self._prerender_task = asyncio.ensure_future(
+            self._prerender(self.page_stack.current_page())
+        )
+
+    async def _prerender(self, page: Page):
+        """
+        Create and render the navigation targets of a page.
+
+        The page below it on the stack, where its back action goes, is
+        rendered too. Rendering fills the image caches of the targets,
+        so when one is navigated to its render only reads cached
+        images. Nothing is sent to the deck. Targets that are not
+        cached are only created while the page cache has room, so
+        prerendering does not bring back pages that were just evicted.
+        """
+        await asyncio.sleep(self.prerender_delay)
+        pages = self.page_stack.pages
+        targets: List[Union[str, Page]] = list(self.navigation_targets(page))
+        if len(pages) > 1:
+            targets.append(pages[-2])
+
+        for target in targets:
+            if self.page_stack.current_page() is not page:
+                return
+            try:
+                if isinstance(target, str):
+                    if target not in self.page_cache and not self.page_cache.has_room():
+                        LOGGER.debug(f"No room to prerender page {target}")
+                        continue
+                    target = await self._get_page(target)
+                if target is not None:
+                    LOGGER.debug(f"Prerendering page {target}")
+                    await target.render()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                LOGGER.exception(f"Failed to prerender page {target}")
+
     def shutdown(self):
         """
         Gracefully stop controlling the deck
         """
-        self.deck.reset()
-        self.deck.close()
+        for task in self._connect_tasks.values():
+            task.cancel()
+        if self._prerender_task is not None:
+            self._prerender_task.cancel()
+        self.page_stack.stop()
+        self._scheduler.stop()
+        self._writer.stop()
+        self.invalidate_framebuffer()
+        if self.attached:
+            self.attached = False
+            self.deck.reset()
+            self.deck.close()
 
     def heartbeat(self):
         pass
 
     async def __call__(self, deck, key, state):
         LOGGER.info(f"Deck {deck.id()} button {key} {'pressed' if state else 'released'}" )
-        current = await self.page_stack.current_page()
-        await current.dispatch(key, state)
+        token = UPDATE_PRIORITY.set(Priority.Input)
+        try:
+            with tracing.span("press" if state else "release",
+                              deck=deck.id(), button=key) as span:
+                current = self.page_stack.current_page()
+                span.set(page=current.__class__.__name__)
+                await current.dispatch(key, state)
+        except Exception:
+            # Nothing awaits key callbacks, so log failures here rather
+            # than losing them.
+            LOGGER.exception(f"Error handling button {key} on deck {deck.id()}")
+        finally:
+            UPDATE_PRIORITY.reset(token)
 
 
 
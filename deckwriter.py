@@ -0,0 +1,177 @@
+import logging
+import threading
+import time
+
+from typing import Dict, Optional, Tuple
+
+from StreamDeck.Devices.StreamDeck import StreamDeck
+
+from tracing import FrameTrace
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class DeckWriter:
+    """
+    Sends key images to a deck from a dedicated thread.
+
+    Writing an image to a key is a blocking USB transfer, so it should
+    not happen on the event loop. Images are placed into a slot for
+    each key and the writer thread sends them to the deck highest
+    priority first, and otherwise in the order the keys were first
+    queued. A newer image for a key replaces any image for that key
+    that has not been sent yet, so rapid updates never build a
+    backlog; only the latest image for each key is sent.
+
+    The writer also remembers the last image sent to each key, and
+    images that are already displayed are not sent again.
+    """
+
+    _pending: Dict[int, Tuple[int, bytes, Tuple[FrameTrace, ...]]]
+    _displayed: Dict[int, bytes]
+
+    def __init__(self, deck: StreamDeck):
+        self.deck = deck
+
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._displayed = {}
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """
+        Start the writer thread.
+        """
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"deck-writer-{self.deck.id()}",
+            daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 1.0):
+        """
+        Stop the writer thread, discarding any images not yet sent.
+        """
+        with self._cond:
+            self._running = False
+            self._pending.clear()
+            self._cond.notify()
+
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def submit(self, key: int, image: bytes, priority: int = 0) -> bool:
+        """
+        Queue an image to be sent to a key.
+
+        Returns False if the key already displays this image and
+        nothing was queued.
+        """
+        with self._cond:
+            queued = self._submit(key, image, priority, ())
+            if queued:
+                self._cond.notify()
+            return queued
+
+    def submit_many(self, images: Dict[int, bytes], priority: int = 0,
+                    trace: Optional[FrameTrace] = None) -> int:
+        """
+        Queue images for several keys at once.
+
+        All the images are queued together, so the writer never sends
+        part of the batch before the rest is queued. The trace, if any,
+        is told when each key has been written. Returns the number of
+        images queued.
+        """
+        traces = (trace,) if trace is not None else ()
+        with self._cond:
+            count = 0
+            for key, image in images.items():
+                if self._submit(key, image, priority, traces):
+                    count += 1
+                elif trace is not None:
+                    trace.key_done(key)
+            if count:
+                self._cond.notify()
+            return count
+
+    def _submit(self, key: int, image: bytes, priority: int,
+                traces: Tuple[FrameTrace, ...]) -> bool:
+        if key in self._pending:
+            old_priority, _, old_traces = self._pending[key]
+            if image == self._displayed.get(key):
+                # Latest image is already on the key, drop the
+                # stale image waiting to be sent.
+                del self._pending[key]
+                for trace in old_traces:
+                    trace.key_done(key)
+                return False
+            # The new image supersedes the old one, so its write
+            # completes the frames waiting on the old image too.
+            self._pending[key] = (
+                max(priority, old_priority),
+                image,
+                old_traces + traces
+            )
+            return True
+
+        if image == self._displayed.get(key):
+            LOGGER.debug(f"Key {key} unchanged, skipping write")
+            return False
+
+        self._pending[key] = (priority, image, traces)
+        return True
+
+    def invalidate(self):
+        """
+        Forget the images displayed on the deck.
+
+        This must be called whenever the deck is reset, since the keys
+        no longer show the images that were sent.
+        """
+        with self._cond:
+            self._displayed.clear()
+
+    def _next(self):
+        """
+        Wait for the next image to send, returns None when stopped.
+        """
+        with self._cond:
+            while self._running and not self._pending:
+                self._cond.wait()
+
+            if not self._running:
+                return None
+
+            key = max(self._pending, key=lambda k: self._pending[k][0])
+            _, image, traces = self._pending.pop(key)
+            # An image being sent counts as displayed, so an identical
+            # image submitted during the transfer is not sent twice.
+            self._displayed[key] = image
+            return key, image, traces
+
+    def _run(self):
+        LOGGER.debug(f"Starting writer thread for deck {self.deck.id()}")
+        while (item := self._next()) is not None:
+            key, image, traces = item
+            try:
+                start = time.perf_counter_ns()
+                self.deck.set_key_image(key, image)
+                end = time.perf_counter_ns()
+                for trace in traces:
+                    trace.key_done(key, start, end)
+            except Exception as e:
+                LOGGER.error(f"Failed to write image to key {key}: {e}")
+                with self._cond:
+                    if self._displayed.get(key) is image:
+                        del self._displayed[key]
+        LOGGER.debug(f"Writer thread for deck {self.deck.id()} stopped")
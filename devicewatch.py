@@ -0,0 +1,218 @@
+"""
+Watches for stream decks being plugged in and unplugged.
+
+On Linux with pyudev installed, the watcher listens for hidraw events
+on a udev netlink socket and rescans the devices as soon as one is
+added or removed. Without pyudev, the devices are polled instead.
+"""
+
+import asyncio
+import logging
+import time
+
+from typing import Awaitable, Callable, Dict, Iterable, List, Tuple
+
+from StreamDeck.DeviceManager import DeviceManager
+from StreamDeck.Devices.StreamDeck import StreamDeck
+
+try:
+    import pyudev
+except ImportError:
+    pyudev = None
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+# Seconds between scans when polling for devices
+POLL_INTERVAL = 2.0
+
+# Seconds between scans when udev events are available. Scans are
+# triggered by the events, this only catches anything missed.
+RESCAN_INTERVAL = 60.0
+
+# Seconds to wait after a udev event before scanning, so a burst of
+# events for one device causes one scan, and the device node is ready
+SETTLE_TIME = 0.1
+
+# Seconds to wait before attaching a deck again after it failed,
+# doubled on every failure
+MIN_RETRY = 2.0
+MAX_RETRY = 60.0
+
+
+def enumerate_decks() -> List[StreamDeck]:
+    return DeviceManager().enumerate()
+
+
+class DeviceWatcher:
+    """
+    Attaches decks when they appear and detaches them when they go.
+
+    Decks are identified by their device id. ``attach`` is called with
+    each new deck in a task of its own, so a deck that is slow to set
+    up does not hold up the others or the watching, and returns
+    whether the deck was set up. A deck that failed is attached again
+    on a later scan, backing off on repeated failures. ``detach`` is
+    awaited with the id of each deck that has gone.
+    """
+
+    _present: Dict[str, StreamDeck]
+    _attaching: "Dict[str, asyncio.Task]"
+    _retry: Dict[str, Tuple[float, float]]
+
+    def __init__(self,
+                 attach: Callable[[StreamDeck], Awaitable[bool]],
+                 detach: Callable[[str], Awaitable[None]],
+                 enumerate: Callable[[], Iterable[StreamDeck]] = enumerate_decks,
+                 poll_interval: float = POLL_INTERVAL):
+        self.attach = attach
+        self.detach = detach
+        self.enumerate = enumerate
+        self.poll_interval = poll_interval
+
+        self._present = {}
+        self._attaching = {}
+        # Time of the next attempt and the backoff, for failed decks
+        self._retry = {}
+        self._changed = asyncio.Event()
+        self._monitor = None
+
+    @property
+    def devices(self) -> List[StreamDeck]:
+        return list(self._present.values())
+
+    async def scan(self, wait: bool = False) -> int:
+        """
+        Attach new decks and detach removed ones.
+
+        Returns the number of decks this scan started attaching, or
+        with wait set, waits for them and returns the number attached.
+        """
+        loop = asyncio.get_running_loop()
+        devices = await loop.run_in_executor(None, self.enumerate)
+        found = {deck.id(): deck for deck in devices}
+
+        for device_id in [i for i in self._present if i not in found]:
+            LOGGER.info(f"Deck {device_id} removed")
+            self._retry.pop(device_id, None)
+            await self._remove(device_id)
+
+        # A deck unplugged and plugged back in between two scans keeps
+        # its device id, but the handle of the old deck is dead
+        for device_id in [i for i in self._present if i not in self._attaching]:
+            if not await loop.run_in_executor(None, self._alive, self._present[device_id]):
+                LOGGER.info(f"Deck {device_id} was replugged")
+                await self._remove(device_id)
+
+        now = time.monotonic()
+        new = [
+            deck for i, deck in found.items()
+            if i not in self._present and self._retry.get(i, (0, 0))[0] <= now
+        ]
+        tasks = []
+        for deck in new:
+            LOGGER.info(f"Deck {deck.id()} added")
+            self._present[deck.id()] = deck
+            task = asyncio.ensure_future(self._attach(deck))
+            self._attaching[deck.id()] = task
+            tasks.append(task)
+
+        if not wait:
+            return len(tasks)
+        return sum(await asyncio.gather(*tasks))
+
+    def _alive(self, deck: StreamDeck) -> bool:
+        try:
+            return deck.is_open() and deck.connected()
+        except Exception:
+            return False
+
+    async def _attach(self, deck: StreamDeck) -> bool:
+        device_id = deck.id()
+        try:
+            attached = await self.attach(deck)
+        except Exception:
+            LOGGER.exception(f"Failed to attach deck {device_id}")
+            attached = False
+        finally:
+            if self._attaching.get(device_id) is asyncio.current_task():
+                del self._attaching[device_id]
+
+        if attached:
+            self._retry.pop(device_id, None)
+        elif self._present.get(device_id) is deck:
+            # Forget the deck, so a later scan tries again
+            del self._present[device_id]
+            _, delay = self._retry.get(device_id, (0, MIN_RETRY / 2))
+            delay = min(delay * 2, MAX_RETRY)
+            LOGGER.info(f"Retrying deck {device_id} in {delay:.0f}s")
+            self._retry[device_id] = (time.monotonic() + delay, delay)
+        return attached
+
+    async def _remove(self, device_id: str):
+        del self._present[device_id]
+        if (task := self._attaching.pop(device_id, None)) is not None:
+            task.cancel()
+        try:
+            await self.detach(device_id)
+        except Exception:
+            LOGGER.exception(f"Failed to detach deck {device_id}")
+
+    def _start_monitor(self) -> bool:
+        """
+        Listen for udev hidraw events, returns False if unavailable.
+        """
+        if pyudev is None:
+            return False
+        try:
+            context = pyudev.Context()
+            monitor = pyudev.Monitor.from_netlink(context)
+            monitor.filter_by("hidraw")
+            monitor.start()
+            asyncio.get_running_loop().add_reader(
+                monitor.fileno(), self._on_udev_event
+            )
+        except Exception as e:
+            LOGGER.warning(f"Cannot monitor udev, polling for decks: {e}")
+            return False
+        self._monitor = monitor
+        return True
+
+    def _stop_monitor(self):
+        if (monitor := self._monitor) is not None:
+            self._monitor = None
+            asyncio.get_running_loop().remove_reader(monitor.fileno())
+
+    def _on_udev_event(self):
+        # Drain the socket, any hidraw event causes a rescan
+        while (device := self._monitor.poll(timeout=0)) is not None:
+            LOGGER.debug(f"udev {device.action} {device.device_node}")
+        self._changed.set()
+
+    async def run(self):
+        """
+        Watch for decks until cancelled.
+        """
+        if self._start_monitor():
+            LOGGER.info("Watching for decks with udev")
+            interval = RESCAN_INTERVAL
+        else:
+            LOGGER.info(f"Polling for decks every {self.poll_interval}s")
+            interval = self.poll_interval
+
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), interval)
+                    await asyncio.sleep(SETTLE_TIME)
+                except asyncio.TimeoutError:
+                    pass
+                self._changed.clear()
+
+                try:
+                    await self.scan()
+                except Exception:
+                    LOGGER.exception("Failed to scan for decks")
+        finally:
+            self._stop_monitor()
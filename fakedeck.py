@@ -0,0 +1,160 @@
+import asyncio
+import importlib
+import itertools
+import logging
+import threading
+import time
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+# Device classes in StreamDeck.Devices that the fake deck can imitate.
+LAYOUTS = {
+    "mini": "StreamDeckMini",
+    "original": "StreamDeckOriginal",
+    "originalv2": "StreamDeckOriginalV2",
+    "xl": "StreamDeckXL",
+}
+
+
+_IDS = itertools.count()
+
+
+class FakeStreamDeck:
+    """
+    In-memory stand in for a StreamDeck device.
+
+    This implements the parts of the StreamDeck interface used by the
+    controller, using the key layout and image format of a real device
+    class. Writing a key image sleeps for the simulated USB latency,
+    and every write is recorded with the time it completed, so
+    benchmarks can measure when an image reached the deck.
+    """
+
+    def __init__(self, layout: str = "mini", latency: float = 0.0):
+        module_name = LAYOUTS[layout]
+        module = importlib.import_module(f"StreamDeck.Devices.{module_name}")
+        self._device_class = getattr(module, module_name)
+
+        self.layout = layout
+        self.latency = latency
+
+        self.KEY_COUNT = self._device_class.KEY_COUNT
+        self.KEY_ROWS = self._device_class.KEY_ROWS
+        self.KEY_COLS = self._device_class.KEY_COLS
+
+        self._id = f"fake-{layout}-{next(_IDS)}"
+        self._open = False
+        self._callback: Optional[Callable] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self._cond = threading.Condition()
+        self.images: Dict[int, bytes] = {}
+        self.writes: List[Tuple[float, int]] = []
+        self.resets = 0
+
+    def __repr__(self):
+        return f"FakeStreamDeck({self.layout!r}, latency={self.latency})"
+
+    def id(self) -> str:
+        return self._id
+
+    def deck_type(self) -> str:
+        return self._device_class.DECK_TYPE
+
+    def open(self):
+        self._open = True
+
+    def close(self):
+        self._open = False
+
+    def is_open(self) -> bool:
+        return self._open
+
+    def connected(self) -> bool:
+        return True
+
+    def key_count(self) -> int:
+        return self.KEY_COUNT
+
+    def key_layout(self) -> Tuple[int, int]:
+        return self.KEY_ROWS, self.KEY_COLS
+
+    def key_image_format(self):
+        device_class = self._device_class
+        return {
+            "size": (device_class.KEY_PIXEL_WIDTH, device_class.KEY_PIXEL_HEIGHT),
+            "format": device_class.KEY_IMAGE_FORMAT,
+            "flip": device_class.KEY_FLIP,
+            "rotation": device_class.KEY_ROTATION,
+        }
+
+    def reset(self):
+        with self._cond:
+            self.images.clear()
+            self.resets += 1
+
+    def set_brightness(self, percent):
+        pass
+
+    def set_key_image(self, key: int, image):
+        if not 0 <= key < self.KEY_COUNT:
+            raise IndexError(f"Invalid key index {key}.")
+
+        image = bytes(image)
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self._cond:
+            self.images[key] = image
+            self.writes.append((time.perf_counter(), key))
+            self._cond.notify_all()
+
+    def set_key_callback(self, callback):
+        self._callback = callback
+        self._loop = None
+
+    def set_key_callback_async(self, async_callback, loop=None):
+        self._callback = async_callback
+        self._loop = loop or asyncio.get_event_loop()
+
+    async def key_event(self, key: int, state: bool):
+        """
+        Simulate a key being pressed or released.
+
+        Like the real device, asynchronous callbacks run in their own
+        task.
+        """
+        if self._callback is None:
+            return
+        result = self._callback(self, key, state)
+        if asyncio.iscoroutine(result):
+            await asyncio.ensure_future(result)
+
+    async def press(self, key: int, hold: float = 0.0):
+        """
+        Simulate a key being pressed and released.
+        """
+        await self.key_event(key, True)
+        if hold:
+            await asyncio.sleep(hold)
+        await self.key_event(key, False)
+
+    def wait_for_writes(self, count: int, after: float,
+                        timeout: Optional[float] = None) -> Optional[float]:
+        """
+        Wait for count key writes to complete after a given time.
+
+        Returns the time the last of those writes completed, or None
+        if the writes did not complete within the timeout.
+        """
+        def ready():
+            return sum(1 for t, _ in self.writes if t >= after) >= count
+
+        with self._cond:
+            if not self._cond.wait_for(ready, timeout):
+                return None
+            return [t for t, _ in self.writes if t >= after][count - 1]
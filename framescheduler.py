@@ -0,0 +1,204 @@
+import asyncio
+import contextvars
+import enum
+import logging
+import time
+
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Set
+
+import tracing
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Priority(enum.IntEnum):
+    """
+    Priority of an update to the deck.
+
+    Input priority is used for updates caused by key presses, which
+    the user is waiting to see. Everything else, such as heartbeats
+    and OBS events, is background priority.
+    """
+    Background = 0
+    Input = 1
+
+
+# Priority of updates requested in the current context. This is set
+# while dispatching key presses, so any update caused by the press
+# is sent with input priority.
+UPDATE_PRIORITY: "contextvars.ContextVar[Priority]" = contextvars.ContextVar(
+    "update_priority", default=Priority.Background
+)
+
+
+class FrameScheduler:
+    """
+    Batches update requests for a deck into frames.
+
+    All update requests that arrive within the frame window are
+    combined into a single render and flush. A request for a full
+    render replaces any key images requested before it, and key images
+    requested after it replace the rendered images for those keys.
+    Requests to re-render some keys are combined, and only those keys
+    are rendered unless the frame is a full render. A frame rendered
+    ahead, such as a page transition, replaces everything requested
+    before it.
+
+    Input priority requests do not wait for the window, and the frame
+    they are part of is sent to the deck ahead of background writes.
+    """
+
+    _keys: Dict[int, bytes]
+    _dirty: Set[int]
+    _waiters: "List[asyncio.Future]"
+    _spans: "List[tracing.Span]"
+
+    def __init__(self,
+                 render: Callable[[], Awaitable[List[bytes]]],
+                 flush: Callable[[Dict[int, bytes], Priority,
+                                  Optional[tracing.FrameTrace]], None],
+                 window: float = 0.01,
+                 render_keys: Optional[Callable[[Set[int]],
+                                                Awaitable[Dict[int, bytes]]]] = None):
+        self.render = render
+        self.render_keys = render_keys
+        self.flush = flush
+        self.window = window
+
+        self._full = False
+        self._keys = {}
+        self._dirty = set()
+        self._priority = Priority.Background
+        self._waiters = []
+        self._spans = []
+        self._requested = 0
+
+        self._wakeup = asyncio.Event()
+        self._urgent = asyncio.Event()
+        self._task: "Optional[asyncio.Task]" = None
+
+    def request(self,
+                full: bool = False,
+                keys: Optional[Dict[int, bytes]] = None,
+                priority: Optional[Priority] = None,
+                dirty: Iterable[int] = (),
+                frame: Optional[Sequence[bytes]] = None) -> "asyncio.Future":
+        """
+        Request an update of the deck in the next frame.
+
+        Keys in dirty are re-rendered, keys given images are set to
+        those images, and a frame gives the images of every key.
+        Returns a future that completes when the frame containing the
+        update has been flushed to the deck.
+        """
+        if priority is None:
+            priority = UPDATE_PRIORITY.get()
+
+        if frame is not None:
+            self._full = False
+            self._dirty.clear()
+            self._keys = dict(enumerate(frame))
+
+        if full:
+            self._full = True
+            self._keys.clear()
+            self._dirty.clear()
+        if dirty := set(dirty):
+            if self.render_keys is None:
+                self._full = True
+                self._keys.clear()
+                self._dirty.clear()
+            else:
+                if not self._full:
+                    self._dirty.update(dirty)
+                # The newest request for a key wins, so images given
+                # before it was dirtied are out of date
+                for key in dirty:
+                    self._keys.pop(key, None)
+        if keys:
+            self._keys.update(keys)
+
+        self._priority = max(self._priority, priority)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+
+        if (span := tracing.current_span()) is not None:
+            if not self._spans:
+                self._requested = time.perf_counter_ns()
+            self._spans.append(span)
+
+        self._ensure_running()
+        self._wakeup.set()
+        if priority >= Priority.Input:
+            self._urgent.set()
+        return future
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        """
+        Stop scheduling frames, pending requests are cancelled.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for future in self._waiters:
+            future.cancel()
+        self._waiters = []
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+
+            if self._priority < Priority.Input and self.window > 0:
+                try:
+                    await asyncio.wait_for(self._urgent.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+
+            self._wakeup.clear()
+            self._urgent.clear()
+
+            full, self._full = self._full, False
+            keys, self._keys = self._keys, {}
+            dirty, self._dirty = self._dirty, set()
+            priority, self._priority = self._priority, Priority.Background
+            waiters, self._waiters = self._waiters, []
+            spans, self._spans = self._spans, []
+
+            if spans:
+                frame_start = time.perf_counter_ns()
+                tracing.record_span("frame_wait", spans, self._requested, frame_start)
+
+            LOGGER.debug(f"Frame with {len(waiters)} requests, {full=}, "
+                         f"dirty {sorted(dirty)}, keys {list(keys)}, {priority=}")
+            try:
+                images = {}
+                if full:
+                    images.update(enumerate(await self.render()))
+                elif dirty:
+                    images.update(await self.render_keys(dirty))
+                if spans and (full or dirty):
+                    tracing.record_span(
+                        "render", spans, frame_start, time.perf_counter_ns()
+                    )
+                images.update(keys)
+
+                trace = tracing.FrameTrace(spans, len(images)) if spans else None
+                self.flush(images, priority, trace)
+            except asyncio.CancelledError:
+                for future in waiters:
+                    future.cancel()
+                raise
+            except Exception as e:
+                LOGGER.error(f"Failed to update deck: {e}")
+                for future in waiters:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for future in waiters:
+                    if not future.done():
+                        future.set_result(None)
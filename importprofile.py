@@ -0,0 +1,124 @@
+"""
+Profiling of module imports.
+
+Set STREAMDECK_IMPORT_PROFILE to time the import of every module and
+print the slowest once the decks have been painted, along with the
+time from startup to the first frame. Page modules are imported
+lazily, so they only appear if they were needed for the first frame;
+modules imported later are included in later reports.
+"""
+
+import importlib.abc
+import os
+import sys
+import threading
+import time
+
+from typing import Dict, Optional, Tuple
+
+
+PROFILE_ENV = "STREAMDECK_IMPORT_PROFILE"
+
+# Time the process started importing, close enough to startup
+_START = time.perf_counter()
+
+_PROFILER: "Optional[ImportProfiler]" = None
+
+
+class ImportProfiler(importlib.abc.MetaPathFinder):
+    """
+    Times the execution of each module as it is imported.
+
+    The profiler finds modules with the other finders and wraps the
+    loader of each, recording the time spent executing the module
+    itself and including the modules it imports.
+    """
+
+    times: Dict[str, Tuple[int, int]]
+
+    def __init__(self):
+        self.times = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            if (spec := finder.find_spec(fullname, path, target)) is not None:
+                break
+        else:
+            return None
+
+        # Built in and frozen modules are loaded by the importer class
+        # itself, which must not be patched. They are cheap anyway.
+        loader = spec.loader
+        if (loader is not None and not isinstance(loader, type)
+                and hasattr(loader, "exec_module")):
+            loader.exec_module = self._timed(fullname, loader.exec_module)
+        return spec
+
+    def _timed(self, name, exec_module):
+        def exec_module_timed(module):
+            # Time of the modules imported by each module being executed
+            stack = self._local.__dict__.setdefault("stack", [])
+            stack.append(0)
+            start = time.perf_counter_ns()
+            try:
+                exec_module(module)
+            finally:
+                total = time.perf_counter_ns() - start
+                children = stack.pop()
+                if stack:
+                    stack[-1] += total
+                with self._lock:
+                    self.times[name] = (total - children, total)
+        return exec_module_timed
+
+    def report(self, limit: int = 25) -> str:
+        """
+        Format the slowest imports as a table, by cumulative time.
+        """
+        with self._lock:
+            items = sorted(self.times.items(), key=lambda i: -i[1][1])
+        lines = [f"{'self ms':>8} {'total ms':>9}  module"]
+        for name, (own, total) in items[:limit]:
+            lines.append(f"{own / 1e6:>8.1f} {total / 1e6:>9.1f}  {name}")
+        own_total = sum(own for own, _ in self.times.values())
+        lines.append(f"{len(items)} modules imported in {own_total / 1e6:.1f}ms")
+        return "\n".join(lines)
+
+
+def enable():
+    """
+    Start timing imports, only imports after this are timed.
+    """
+    global _PROFILER
+    if _PROFILER is None:
+        _PROFILER = ImportProfiler()
+        sys.meta_path.insert(0, _PROFILER)
+
+
+def enabled() -> bool:
+    return _PROFILER is not None
+
+
+def configure_from_env():
+    """
+    Enable profiling if STREAMDECK_IMPORT_PROFILE is set.
+    """
+    if PROFILE_ENV in os.environ:
+        enable()
+
+
+def since_start() -> float:
+    """
+    Seconds since the process started importing.
+    """
+    return time.perf_counter() - _START
+
+
+def report(limit: int = 25) -> str:
+    if _PROFILER is None:
+        return ""
+    return _PROFILER.report(limit)
@@ -0,0 +1,204 @@
+"""
+Start applications from deck buttons.
+
+Applications are executed directly, without a shell, and every child
+is reaped in the background as soon as it exits, so pressing buttons
+never leaves zombies behind. Running applications are tracked per
+action, which allows raising the window of an application that is
+already running instead of starting it again, and repeated presses
+of the same action within a short interval are ignored.
+
+A button press only schedules the launch, so even heavy applications
+start without holding up the deck.
+"""
+
+import asyncio
+import logging
+import os
+import shlex
+import shutil
+import time
+
+from typing import Dict, Optional, Sequence, Set, Tuple
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+POSIX_SPAWN_ENV = "STREAMDECK_POSIX_SPAWN"
+
+# Seconds during which repeated presses of an action are ignored
+MIN_INTERVAL = 1.0
+
+# Characters that need a shell to interpret a command
+SHELL_CHARACTERS = set("|&;<>()$`\\\"'*?[]#~=\n")
+
+
+def command_argv(cmd: str) -> Tuple[str, ...]:
+    """
+    Split a command line into arguments.
+
+    Commands using shell syntax are run by /bin/sh, anything else is
+    executed directly.
+    """
+    if SHELL_CHARACTERS.intersection(cmd):
+        return ("/bin/sh", "-c", cmd)
+    return tuple(shlex.split(cmd))
+
+
+class Launcher:
+    """
+    Starts and supervises the applications of button actions.
+
+    Actions are identified by their argument list. With posix_spawn
+    the child is started with os.posix_spawnp and reaped through a
+    pidfd, otherwise with asyncio subprocesses.
+    """
+
+    _running: "Dict[Tuple[str, ...], Set[int]]"
+    _starting: "Dict[Tuple[str, ...], asyncio.Task]"
+    _pressed: "Dict[Tuple[str, ...], float]"
+
+    def __init__(self, min_interval: float = MIN_INTERVAL,
+                 posix_spawn: bool = False):
+        self.min_interval = min_interval
+        # posix_spawn needs a pidfd to reap the child without a thread
+        self.posix_spawn = (
+            posix_spawn and hasattr(os, "posix_spawnp")
+            and hasattr(os, "pidfd_open")
+        )
+
+        self._running = {}
+        self._starting = {}
+        self._pressed = {}
+
+    def running(self, argv: Sequence[str]) -> Set[int]:
+        """
+        Process ids of the running applications of an action.
+        """
+        return set(self._running.get(tuple(argv), ()))
+
+    def launch(self, argv: Sequence[str], single: bool = False,
+               focus: Optional[str] = None) -> Optional["asyncio.Task"]:
+        """
+        Start an application in the background.
+
+        If single is set, an application that is still running is not
+        started again. If focus is set, the window with that class is
+        raised instead of starting the application again, and the
+        application is started only if no such window exists. Returns
+        the task starting the application, or None if the press was
+        ignored. Raises ValueError if the command is empty.
+        """
+        if not (argv := tuple(argv)):
+            raise ValueError("Cannot launch an empty command")
+        now = time.monotonic()
+        if now - self._pressed.get(argv, -self.min_interval) < self.min_interval:
+            LOGGER.info(f"Ignoring repeated launch of {argv[0]}")
+            return None
+        self._pressed[argv] = now
+
+        if (task := self._starting.get(argv)) is not None and not task.done():
+            LOGGER.info(f"{argv[0]} is already being started")
+            return None
+
+        task = asyncio.ensure_future(self._launch(argv, single, focus))
+        self._starting[argv] = task
+        return task
+
+    async def _launch(self, argv: Tuple[str, ...], single: bool,
+                      focus: Optional[str]):
+        try:
+            if focus is not None and await self._focus(focus):
+                LOGGER.info(f"Raised running {argv[0]}")
+                return
+            if single and self._running.get(argv):
+                LOGGER.info(f"{argv[0]} is already running")
+                return
+
+            LOGGER.info(f"Starting application {argv[0]}")
+            if self.posix_spawn:
+                pid = self._posix_spawn(argv)
+                wait = self._wait_pidfd(pid)
+            else:
+                process = await asyncio.create_subprocess_exec(
+                    *argv,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.DEVNULL,
+                    start_new_session=True
+                )
+                pid = process.pid
+                wait = process.wait()
+        except OSError as e:
+            LOGGER.error(f"Cannot start {argv[0]}: {e}")
+            return
+        finally:
+            self._starting.pop(argv, None)
+
+        self._running.setdefault(argv, set()).add(pid)
+        try:
+            returncode = await wait
+            LOGGER.info(f"{argv[0]} ({pid}) exited with {returncode}")
+        finally:
+            if (pids := self._running.get(argv)) is not None:
+                pids.discard(pid)
+                if not pids:
+                    del self._running[argv]
+
+    def _posix_spawn(self, argv: Tuple[str, ...]) -> int:
+        file_actions = [
+            (os.POSIX_SPAWN_OPEN, fd, os.devnull, flags, 0)
+            for fd, flags in ((0, os.O_RDONLY), (1, os.O_WRONLY), (2, os.O_WRONLY))
+        ]
+        return os.posix_spawnp(
+            argv[0], argv, os.environ,
+            file_actions=file_actions,
+            setsid=True
+        )
+
+    async def _wait_pidfd(self, pid: int) -> Optional[int]:
+        """
+        Wait for a child started with posix_spawn to exit and reap it.
+        """
+        loop = asyncio.get_running_loop()
+        fd = os.pidfd_open(pid)
+        exited = loop.create_future()
+        loop.add_reader(fd, lambda: exited.done() or exited.set_result(None))
+        try:
+            await exited
+        finally:
+            loop.remove_reader(fd)
+            os.close(fd)
+        _, status = os.waitpid(pid, 0)
+        return os.waitstatus_to_exitcode(status)
+
+    async def _focus(self, window_class: str) -> bool:
+        """
+        Raise a window by its class, return whether one was found.
+        """
+        if (wmctrl := shutil.which("wmctrl")) is None:
+            LOGGER.debug("wmctrl is not installed, cannot raise windows")
+            return False
+        process = await asyncio.create_subprocess_exec(
+            wmctrl, "-x", "-a", window_class,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        return await process.wait() == 0
+
+
+_LAUNCHER: Optional[Launcher] = None
+
+
+def get_launcher() -> Launcher:
+    """
+    Get the launcher shared by all pages and decks.
+
+    posix_spawn is used if STREAMDECK_POSIX_SPAWN is set.
+    """
+    global _LAUNCHER
+    if _LAUNCHER is None:
+        _LAUNCHER = Launcher(posix_spawn=bool(os.environ.get(POSIX_SPAWN_ENV)))
+    return _LAUNCHER
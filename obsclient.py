@@ -0,0 +1,363 @@
+"""
+Shared connection to OBS.
+
+A single connection to the OBS websocket is shared by every page and
+deck. The connection is kept up in the background, reconnecting with
+exponential backoff whenever OBS is not running, and the recording
+state is read again every time the connection comes up, so it is
+correct even if it changed while OBS was away.
+
+Requests are sent as soon as they are made and their responses are
+matched by message id, so any number of requests can be in flight
+at once.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import uuid
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import simpleobsws as obs
+import websockets
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+HOST_ENV = "STREAMDECK_OBS_HOST"
+PORT_ENV = "STREAMDECK_OBS_PORT"
+PASSWORD_ENV = "STREAMDECK_OBS_PASSWORD"
+
+# Seconds to wait before the first reconnect, doubled on every failure
+MIN_BACKOFF = 0.5
+MAX_BACKOFF = 10.0
+
+# Seconds to wait for a connection or a response
+REQUEST_TIMEOUT = 5.0
+
+# Recording state after each OBS event
+RECORDING_EVENTS = {
+    "RecordingStarted": "recording",
+    "RecordingResumed": "recording",
+    "RecordingPaused": "paused",
+    "RecordingStopping": "stopped",
+    "RecordingStopped": "stopped",
+}
+
+
+class OBSError(Exception):
+    """
+    Raised when a request to OBS fails.
+    """
+
+
+class PipelinedObsws(obs.obsws):
+    """
+    OBS websocket client that does not poll for responses.
+
+    obsws checks for the response to a request every 100ms, and only
+    the request being waited on. Here every request gets a future
+    that the receive task completes as soon as its response arrives.
+    """
+
+    _pending: "Dict[str, asyncio.Future]"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pending = {}
+        # Set once the connection has closed
+        self.closed = asyncio.Event()
+
+    async def call(self, request_type, data=None, timeout=15):
+        if data is not None and not isinstance(data, dict):
+            raise obs.MessageFormatError("Input data must be valid dict object")
+        if self.ws is None or self.closed.is_set():
+            raise obs.ConnectionFailure("Not connected to OBS")
+
+        request_id = str(uuid.uuid4())
+        payload = dict(data or {})
+        payload["message-id"] = request_id
+        payload["request-type"] = request_type
+
+        future = self.loop.create_future()
+        self._pending[request_id] = future
+        try:
+            await self.ws.send(json.dumps(payload))
+            return await asyncio.wait_for(future, timeout)
+        except websockets.exceptions.ConnectionClosed as e:
+            raise obs.ConnectionFailure(f"Connection to OBS closed: {e}") from e
+        except asyncio.TimeoutError:
+            raise obs.MessageTimeout(
+                f"The request with type {request_type} timed out after "
+                f"{timeout} seconds."
+            ) from None
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def _ws_recv_task(self):
+        try:
+            while True:
+                message = await self.ws.recv()
+                try:
+                    result = json.loads(message)
+                except ValueError:
+                    LOGGER.warning(f"Invalid message from OBS: {message!r}")
+                    continue
+
+                if "update-type" in result:
+                    for callback, trigger in self.event_functions:
+                        if trigger is None or trigger == result["update-type"]:
+                            self.loop.create_task(callback(result))
+                elif (future := self._pending.get(result.pop("message-id", None))) is not None:
+                    if not future.done():
+                        future.set_result(result)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(
+                        obs.ConnectionFailure("Connection to OBS closed")
+                    )
+            self.closed.set()
+
+
+class OBSClient:
+    """
+    Connection to OBS kept up in the background.
+
+    Subscribers are called with the client whenever the connection
+    comes up or goes down, and whenever the recording state changes.
+    The status is "disconnected" while OBS is not connected, and
+    otherwise the recording state: "stopped", "recording" or "paused".
+    """
+
+    _subscribers: "List[Callable[[OBSClient], Awaitable[None]]]"
+
+    def __init__(self, host: str = "localhost", port: int = 4444,
+                 password: Optional[str] = None,
+                 min_backoff: float = MIN_BACKOFF,
+                 max_backoff: float = MAX_BACKOFF,
+                 timeout: float = REQUEST_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+        self.recording = "stopped"
+        self._ws: Optional[PipelinedObsws] = None
+        self._subscribers = []
+        self._task: "Optional[asyncio.Task]" = None
+        self._connected: Optional[asyncio.Event] = None
+        self._retry: Optional[asyncio.Event] = None
+
+    def __repr__(self):
+        return f"OBSClient({self.host!r}, {self.port})"
+
+    @property
+    def connected(self) -> bool:
+        return self._ws is not None
+
+    @property
+    def status(self) -> str:
+        return self.recording if self.connected else "disconnected"
+
+    def subscribe(self, callback: "Callable[[OBSClient], Awaitable[None]]"):
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: "Callable[[OBSClient], Awaitable[None]]"):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def start(self):
+        """
+        Start connecting in the background, if not already.
+        """
+        if self._task is None or self._task.done():
+            self._connected = asyncio.Event()
+            self._retry = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """
+        Disconnect and stop reconnecting.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if (ws := self._ws) is not None:
+            self._ws = None
+            await ws.disconnect()
+
+    def reconnect_now(self):
+        """
+        Retry the connection now rather than after the backoff.
+        """
+        self.start()
+        self._retry.set()
+
+    async def call(self, request: str, data: Optional[Dict[str, Any]] = None,
+                   timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Send a request to OBS and return the response.
+
+        A request made while OBS is not connected waits for the
+        connection, up to the timeout. Raises OBSError if the request
+        fails or OBS returns an error.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        if not self.connected:
+            self.reconnect_now()
+            try:
+                await asyncio.wait_for(self._connected.wait(), timeout)
+            except asyncio.TimeoutError:
+                raise OBSError("OBS is not connected") from None
+
+        if (ws := self._ws) is None:
+            raise OBSError("OBS is not connected")
+
+        LOGGER.debug(f"Calling OBS request {request}")
+        try:
+            result = await ws.call(request, data, timeout)
+        except (obs.ConnectionFailure, obs.MessageTimeout,
+                obs.MessageFormatError) as e:
+            raise OBSError(f"{request} failed: {e}") from e
+        if result.get("status") == "error":
+            raise OBSError(f"{request} failed: {result.get('error')}")
+        return result
+
+    async def batch(self, *requests: Tuple[str, Optional[Dict[str, Any]]]):
+        """
+        Send several requests at once, return their responses in order.
+
+        The requests are all sent before any response is awaited.
+        """
+        return await asyncio.gather(*(
+            self.call(request, data) for request, data in requests
+        ))
+
+    async def _run(self):
+        delay = self.min_backoff
+        while True:
+            ws = PipelinedObsws(
+                self.host, self.port, self.password,
+                loop=asyncio.get_running_loop()
+            )
+            ws.register(self._on_event)
+            try:
+                await asyncio.wait_for(ws.connect(), self.timeout)
+            except asyncio.CancelledError:
+                await self._discard(ws)
+                raise
+            except Exception as e:
+                LOGGER.info(f"Connection to OBS failed, retrying in "
+                            f"{delay:.1f}s: {e!r}")
+                await self._discard(ws)
+                try:
+                    await asyncio.wait_for(self._retry.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._retry.clear()
+                delay = min(delay * 2, self.max_backoff)
+                continue
+
+            LOGGER.info(f"Connected to OBS at {self.host}:{self.port}")
+            delay = self.min_backoff
+            self._ws = ws
+            try:
+                await self._resync()
+            except OBSError as e:
+                LOGGER.error(f"Cannot read OBS recording state: {e}")
+            self._connected.set()
+            self._notify()
+
+            await ws.closed.wait()
+            LOGGER.info("Connection to OBS lost")
+            self._ws = None
+            self._connected.clear()
+            self._notify()
+
+    async def _discard(self, ws: PipelinedObsws):
+        """
+        Close a connection that failed while connecting.
+        """
+        if ws.ws is None:
+            return
+        try:
+            await asyncio.wait_for(ws.disconnect(), self.timeout)
+        except Exception as e:
+            LOGGER.debug(f"Closing failed OBS connection: {e!r}")
+
+    async def _resync(self):
+        """
+        Read the recording state, which may have changed while OBS
+        was disconnected.
+        """
+        try:
+            result = await self._ws.call("GetRecordingStatus", timeout=self.timeout)
+        except (obs.ConnectionFailure, obs.MessageTimeout) as e:
+            raise OBSError(f"GetRecordingStatus failed: {e}") from e
+
+        if result.get("status") == "error":
+            # Older versions of obs-websocket only report recording
+            # with the streaming status
+            result = await self.call("GetStreamingStatus")
+            recording = result.get("recording", False)
+            paused = result.get("recording-paused", False)
+        else:
+            recording = result.get("isRecording", False)
+            paused = result.get("isRecordingPaused", False)
+
+        if not recording:
+            self.recording = "stopped"
+        else:
+            self.recording = "paused" if paused else "recording"
+        LOGGER.info(f"OBS recording state is {self.recording}")
+
+    async def _on_event(self, event: Dict[str, Any]):
+        kind = event["update-type"]
+        if kind == "Exiting":
+            # OBS is shutting down, drop the connection now rather than
+            # waiting for the socket to close
+            if (ws := self._ws) is not None:
+                await ws.disconnect()
+        elif (recording := RECORDING_EVENTS.get(kind)) is not None:
+            LOGGER.info(f"OBS event {kind}")
+            if recording != self.recording:
+                self.recording = recording
+                self._notify()
+
+    def _notify(self):
+        for callback in list(self._subscribers):
+            asyncio.ensure_future(self._call_subscriber(callback))
+
+    async def _call_subscriber(self, callback):
+        try:
+            await callback(self)
+        except Exception:
+            LOGGER.exception(f"Error in OBS subscriber {callback}")
+
+
+_CLIENT: Optional[OBSClient] = None
+
+
+def get_client() -> OBSClient:
+    """
+    Get the OBS client shared by all pages and decks.
+
+    The host, port and password are read from STREAMDECK_OBS_HOST,
+    STREAMDECK_OBS_PORT and STREAMDECK_OBS_PASSWORD.
+    """
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = OBSClient(
+            os.environ.get(HOST_ENV, "localhost"),
+            int(os.environ.get(PORT_ENV, 4444)),
+            os.environ.get(PASSWORD_ENV)
+        )
+    return _CLIENT
@@ -0,0 +1,190 @@
+"""
+Stand in for the OBS websocket server, for working without OBS.
+
+The mock speaks enough of the obs-websocket 4 protocol for the deck:
+authentication, the recording requests and their events. It can be
+stopped and started again to imitate OBS restarting. Run it on its
+own with::
+
+    python obsmock.py --port 4444
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import secrets
+
+from typing import Any, Dict, List, Optional, Set
+
+import websockets
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class MockOBSServer:
+    """
+    In-process OBS websocket server.
+
+    Every request received is recorded in ``requests``. Responses are
+    delayed by ``latency`` seconds, to check requests are pipelined.
+    """
+
+    requests: List[str]
+
+    def __init__(self, host: str = "localhost", port: int = 4444,
+                 password: Optional[str] = None, latency: float = 0.0):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.latency = latency
+
+        self.recording = False
+        self.paused = False
+        self.requests = []
+
+        self._server = None
+        self._clients: Set[Any] = set()
+        self._salt = secrets.token_urlsafe(16)
+        self._challenge = secrets.token_urlsafe(16)
+
+    async def start(self):
+        self._server = await websockets.serve(self._handle, self.host, self.port)
+        LOGGER.info(f"Mock OBS listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        """
+        Shut down like OBS exiting, sending the Exiting event first.
+        """
+        await self.emit("Exiting")
+        self._server.close()
+        for ws in list(self._clients):
+            await ws.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def emit(self, update_type: str, **fields):
+        message = json.dumps({"update-type": update_type, **fields})
+        for ws in list(self._clients):
+            try:
+                await ws.send(message)
+            except websockets.exceptions.ConnectionClosed:
+                pass
+
+    async def _handle(self, ws, path=None):
+        self._clients.add(ws)
+        authenticated = self.password is None
+        try:
+            async for message in ws:
+                request = json.loads(message)
+                kind = request.get("request-type")
+                self.requests.append(kind)
+
+                if not authenticated and kind not in ("GetAuthRequired", "Authenticate"):
+                    response = self._error("Not Authenticated")
+                elif kind == "Authenticate":
+                    authenticated = request.get("auth") == self._auth()
+                    response = {} if authenticated else self._error("Authentication Failed.")
+                else:
+                    response = await self._respond(kind, request)
+
+                # Each request is answered in its own task, so a slow
+                # response does not hold up the requests behind it
+                asyncio.ensure_future(
+                    self._reply(ws, request["message-id"], response)
+                )
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self._clients.discard(ws)
+
+    async def _reply(self, ws, message_id: str, response: Dict[str, Any]):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        response.setdefault("status", "ok")
+        response["message-id"] = message_id
+        try:
+            await ws.send(json.dumps(response))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    def _error(self, error: str) -> Dict[str, Any]:
+        return {"status": "error", "error": error}
+
+    def _auth(self) -> str:
+        secret = base64.b64encode(
+            hashlib.sha256((self.password + self._salt).encode("utf-8")).digest()
+        )
+        return base64.b64encode(
+            hashlib.sha256(secret + self._challenge.encode("utf-8")).digest()
+        ).decode("utf-8")
+
+    async def _respond(self, kind: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        if kind == "GetAuthRequired":
+            if self.password is None:
+                return {"authRequired": False}
+            return {
+                "authRequired": True,
+                "salt": self._salt,
+                "challenge": self._challenge
+            }
+        if kind == "GetVersion":
+            return {"obs-websocket-version": "4.9.1", "version": 1.1}
+        if kind == "GetRecordingStatus":
+            return {"isRecording": self.recording,
+                    "isRecordingPaused": self.paused}
+        if kind == "StartRecording":
+            if self.recording:
+                return self._error("recording already active")
+            self.recording, self.paused = True, False
+            await self.emit("RecordingStarting")
+            await self.emit("RecordingStarted")
+            return {}
+        if kind == "StopRecording":
+            if not self.recording:
+                return self._error("recording not active")
+            self.recording, self.paused = False, False
+            await self.emit("RecordingStopping")
+            await self.emit("RecordingStopped")
+            return {}
+        if kind == "PauseRecording":
+            if not self.recording or self.paused:
+                return self._error("recording is not active or already paused")
+            self.paused = True
+            await self.emit("RecordingPaused")
+            return {}
+        if kind == "ResumeRecording":
+            if not self.paused:
+                return self._error("recording is not paused")
+            self.paused = False
+            await self.emit("RecordingResumed")
+            return {}
+        return self._error(f"invalid request type {kind}")
+
+
+async def serve(args):
+    server = MockOBSServer(args.host, args.port, args.password, args.latency)
+    await server.start()
+    await asyncio.Event().wait()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Mock OBS websocket server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("-p", "--port", type=int, default=4444)
+    parser.add_argument("--password", help="Require this password")
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Seconds to delay each response"
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(parse_args()))
@@ -1,9 +1,12 @@
 
-__all__ = [ "Page", "get_page", "MainPage" ]
+__all__ = [ "Page", "get_page", "load_page", "warm_up", "MainPage" ]
 
 
-from .base import Page, get_page
+from .base import Page, get_page, load_page, warm_up, PAGE_MODULES
 
 
-
-from .main import MainPage
\ No newline at end of file
+def __getattr__(name):
+    # Page classes are imported on first use, see PAGE_MODULES
+    if name in PAGE_MODULES:
+        return load_page(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
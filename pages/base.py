@@ -2,16 +2,22 @@ import asyncio
 import time
 import logging
 import functools
+import importlib
 import pathlib
+import re
 from collections import defaultdict
 
-from PIL import Image, ImageDraw, ImageFont
-from StreamDeck.ImageHelpers import PILHelper
+import tracing
 
+from .bundle import BUNDLE_NAME, load_bundle
 from .commands import MultiAction
+from .lru import AsyncLRUCache
+from .render import KeyFormat, load_font, render_key_image, run_in_pool
 
-from typing import TYPE_CHECKING, Dict, List, Optional
+from typing import (TYPE_CHECKING, Any, Callable, Dict, FrozenSet, Iterable,
+                    List, Optional, Set, Tuple, Type)
 if TYPE_CHECKING:
+    from PIL import ImageFont
     from controller import Controller
 
 
@@ -20,6 +26,20 @@ LOGGER = logging.getLogger(__name__)
 
 PAGE_REGISTRY: "Dict[str, Page]" = {}
 
+# Number of pages using each image in the key image cache, so an
+# image can be released once no page uses it
+_IMAGE_REFS: Dict[Tuple, int] = {}
+
+# Modules of the pages that are imported when first used, rather than
+# when the package is imported, so their dependencies do not delay the
+# first frame.
+PAGE_MODULES = {
+    "MainPage": "pages.main",
+    "MainMenuPage": "pages.menu",
+    "ClockPage": "pages.clock",
+    "SettingsPage": "pages.settings",
+}
+
 
 def create_action_method(coro, *args, **kwargs):
     @functools.wraps(coro)
@@ -33,31 +53,176 @@ def create_action_method(coro, *args, **kwargs):
 async def get_page(name):
     """
     Load a page
+
+    Pages defined in spec files take precedence over the registry, so
+    a changed spec file is recompiled.
     """
-    global PAGE_REGISTRY
+    from .spec import SPEC_LOADER, SpecError
+
+    try:
+        if (page_class := await SPEC_LOADER.load(name)) is not None:
+            LOGGER.info(f"Got page {name} from spec file")
+            return page_class
+    except SpecError as e:
+        LOGGER.error(f"Cannot load page {name}: {e}")
+        return None
+
     if name in PAGE_REGISTRY:
         LOGGER.info(f"Got page {name} from registry")
-        return PAGE_REGISTRY["name"]
-    
-    # TODO: Implement loading from spec files
+        return PAGE_REGISTRY[name]
+
+    if name in PAGE_MODULES:
+        # Importing runs module code, keep it off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, load_page, name)
+
     LOGGER.warning(f"No page named {name}")
 
 
+def load_page(name: str) -> "Optional[Type[Page]]":
+    """
+    Get a page class from the registry, importing its module if needed.
+    """
+    if (page_class := PAGE_REGISTRY.get(name)) is not None:
+        return page_class
+    if (module := PAGE_MODULES.get(name)) is None:
+        return None
+
+    start = time.perf_counter()
+    importlib.import_module(module)
+    LOGGER.info(f"Imported {module} for page {name} in "
+                f"{(time.perf_counter() - start) * 1000:.1f}ms")
+    return PAGE_REGISTRY.get(name)
 
-def cache(coro):
-    coro_cache = {}
-    lock = asyncio.Lock()
-    @functools.wraps(coro)
-    async def wrapper(self, *args):
-        async with lock:
-            if args in coro_cache:
-                LOGGER.debug(f"Loading {args} from cache")
-                return coro_cache[args]
-            LOGGER.debug(f"Computing {args} for cache")
-            result = await coro(self, *args)
-            coro_cache[args] = result
-            return result
-    return wrapper
+
+def load_pages():
+    """
+    Import the modules of all pages.
+    """
+    for name in PAGE_MODULES:
+        load_page(name)
+
+
+async def warm_up():
+    """
+    Import the modules of all pages in the background.
+
+    This runs once the decks are painted, so the first navigation to
+    a page does not wait for its module to load.
+    """
+    loop = asyncio.get_running_loop()
+    for name in PAGE_MODULES:
+        try:
+            await loop.run_in_executor(None, load_page, name)
+        except Exception:
+            LOGGER.exception(f"Failed to load page {name}")
+
+
+
+def cache(coro=None, *, maxsize: Optional[int] = 256,
+          maxbytes: Optional[int] = 16 * 1024 * 1024):
+    """
+    Cache the results of a page coroutine by its arguments.
+
+    Results are held in a bounded LRU cache. Concurrent calls with the
+    same arguments share one computation and calls with different
+    arguments run in parallel. The cache is available as the `cache`
+    attribute of the decorated function, and its counters through
+    `cache_info`.
+    """
+    def decorator(coro):
+        lru = AsyncLRUCache(maxsize, maxbytes, name=coro.__qualname__)
+
+        @functools.wraps(coro)
+        async def wrapper(self, *args):
+            return await lru.get_or_compute(args, lambda: coro(self, *args))
+
+        wrapper.cache = lru
+        wrapper.cache_info = lru.info
+        wrapper.cache_clear = lru.clear
+        return wrapper
+
+    if coro is None:
+        return decorator
+    return decorator(coro)
+
+
+class StateField:
+    """
+    Page state that the images of some keys depend on.
+
+    Setting the field to a new value re-renders and updates only the
+    keys that depend on it, rather than the whole deck. Keys are given
+    by button number, as in `button_5`.
+    """
+
+    def __init__(self, default: Any = None, buttons: Iterable[int] = ()):
+        self.default = default
+        self.keys = frozenset(button - 1 for button in buttons)
+        self.name = ""
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return instance.__dict__.get(self.name, self.default)
+
+    def __set__(self, instance, value):
+        old = self.__get__(instance)
+        instance.__dict__[self.name] = value
+        if value != old:
+            instance.invalidate_keys(instance.state_keys(self.name, self.keys))
+
+
+BUTTON_HANDLER = re.compile(r"(alt_)?button_(\d+)$")
+CHORD_HANDLER = re.compile(r"chord((?:_\d+){2,})$")
+
+
+def build_dispatch_tables(page_class):
+    """
+    Build the short and long press handler tables of a page class.
+
+    The tables are indexed by key and hold the unbound action method
+    for each key, or None where the default action should be used.
+    Long presses fall back to the short press action.
+    """
+    numbers = [
+        int(match.group(2)) for nm in dir(page_class)
+        if (match := BUTTON_HANDLER.match(nm))
+        and callable(getattr(page_class, nm))
+    ]
+    size = max(numbers, default=0)
+
+    short_handlers = []
+    long_handlers = []
+    for i in range(1, size + 1):
+        short = getattr(page_class, f"button_{i}", None)
+        short = short if callable(short) else None
+        long = getattr(page_class, f"alt_button_{i}", None)
+        long = long if callable(long) else short
+
+        short_handlers.append(short)
+        long_handlers.append(long)
+
+    return tuple(short_handlers), tuple(long_handlers)
+
+
+def build_chord_table(page_class):
+    """
+    Build the chord handler table of a page class.
+
+    Chord actions are methods named after the buttons of the chord,
+    such as `chord_1_2`. The table maps the set of keys of each chord
+    to its action method.
+    """
+    chords = {}
+    for nm in dir(page_class):
+        if (match := CHORD_HANDLER.match(nm)) and callable(handler := getattr(page_class, nm)):
+            keys = frozenset(int(n) - 1 for n in match.group(1)[1:].split("_"))
+            chords[keys] = handler
+    return chords
 
 
 class PageMeta(type):
@@ -76,13 +241,43 @@ class PageMeta(type):
             ns[f"alt_{nm}"] = long_press
 
         new_cls = super().__new__(cls, name, bases, ns)
+        new_cls._update_dispatch_tables()
         PAGE_REGISTRY[name] = new_cls
         return new_cls
 
+    def __setattr__(cls, name, value):
+        super().__setattr__(name, value)
+        if BUTTON_HANDLER.match(name) or CHORD_HANDLER.match(name):
+            cls._update_dispatch_tables()
+
+    def _update_dispatch_tables(cls):
+        """
+        Rebuild the dispatch tables of the class and its subclasses.
+        """
+        short, long = build_dispatch_tables(cls)
+        type.__setattr__(cls, "_short_handlers", short)
+        type.__setattr__(cls, "_long_handlers", long)
+        type.__setattr__(cls, "_chord_handlers", build_chord_table(cls))
+        for subclass in cls.__subclasses__():
+            subclass._update_dispatch_tables()
+
 
 class Page(metaclass=PageMeta):
     pressed_threshold: float = 3.0
+
+    # Action methods for each key, built by PageMeta
+    _short_handlers: Tuple[Optional[Callable], ...] = ()
+    _long_handlers: Tuple[Optional[Callable], ...] = ()
+    _chord_handlers: Dict[FrozenSet[int], Callable] = {}
+
+    # Names of the pages this page navigates to, which are prerendered
+    # while the page is shown
+    navigation_targets: Tuple[str, ...] = ()
+
     heartbeat_time: float = 60.0
+    # Heartbeat time while the page is on the stack but not active,
+    # heartbeats are suspended while hidden if None
+    loaded_heartbeat_time: Optional[float] = None
 
     asset_path = pathlib.Path("~/.local/share/streamdeck").expanduser()
     label_font: str = "Roboto-Regular.ttf"
@@ -94,7 +289,21 @@ class Page(metaclass=PageMeta):
     def __init__(self, controller):
         self.controller = controller
         self._lock = asyncio.Lock()
-        self._pressed = None
+
+        # Press time of each key currently held down
+        self._pressed: Dict[int, float] = {}
+        # Timers that fire the long press action of held keys
+        self._long_press_timers: Dict[int, asyncio.Task] = {}
+        # Held keys whose action has already run, so their release
+        # should not run the short press action
+        self._handled: Set[int] = set()
+
+        # Keys whose state changed since they were last updated
+        self._dirty_keys: Set[int] = set()
+        self._dirty_task: "Optional[asyncio.Future]" = None
+
+        # Keys of the cached images this page has rendered
+        self._image_keys: Set[Tuple] = set()
 
     def __str__(self):
         return f"Deck {self.__class__.__name__}"
@@ -105,14 +314,20 @@ class Page(metaclass=PageMeta):
         """
         LOGGER.info("No action detected, using default")
 
+    async def _call_handler(self, handlers, index):
+        handler = handlers[index] if 0 <= index < len(handlers) else None
+        if handler is None:
+            with tracing.span("action", action="default_action"):
+                await self.default_action()
+            return
+        with tracing.span("action", action=handler.__name__):
+            await handler(self)
+
     async def alt_dispatch(self, button):
         """
         Dispatcher for long press actions.
         """
-        if (func := getattr(self, f"alt_button_{button}", None)) is not None:
-            await func()
-        else:
-            await getattr(self, f"button_{button}", self.default_action())()
+        await self._call_handler(self._long_handlers, button - 1)
 
     async def dispatch(self, button, status):
         """
@@ -120,30 +335,110 @@ class Page(metaclass=PageMeta):
 
         Calls specific button action method. Also handles
         long press dispatching.
+
+        Each key is tracked separately. A long press action runs as
+        soon as the key has been held for the pressed threshold, and
+        the short press action runs on release if it was not. Pressing
+        all the keys of a chord runs the chord action instead, and the
+        keys of the chord do nothing when they are released.
         """
-        async with self._lock:
+        with tracing.span("dispatch"):
             if status:
-                self._pressed = time.time()
-                return
+                await self._key_down(button)
             else:
-                pressed_time = time.time() - self._pressed
+                await self._key_up(button)
 
-        # long press
-        if pressed_time >= self.pressed_threshold:
-            LOGGER.info("Long press detected")
-            await self.alt_dispatch(button+1)
-            return
+    async def _key_down(self, button):
+        async with self._lock:
+            self._pressed[button] = time.time()
+            self._handled.discard(button)
+
+            chord = self._chord_handlers.get(frozenset(self._pressed))
+            if chord is not None:
+                for key in self._pressed:
+                    self._cancel_long_press(key)
+                    self._handled.add(key)
+            else:
+                self._long_press_timers[button] = asyncio.ensure_future(
+                    self._long_press_timer(button)
+                )
+
+        if chord is not None:
+            LOGGER.info(f"Chord detected, calling `{chord.__name__}`")
+            with tracing.span("action", action=chord.__name__):
+                await chord(self)
+
+    async def _key_up(self, button):
+        async with self._lock:
+            self._cancel_long_press(button)
+            if self._pressed.pop(button, None) is None:
+                # Pressed before this page was active
+                return
+            if button in self._handled:
+                self._handled.discard(button)
+                return
 
         LOGGER.info(f"Short press detected, calling `button_{button+1}`")
+        await self._call_handler(self._short_handlers, button)
+
+    def _cancel_long_press(self, button):
+        if (timer := self._long_press_timers.pop(button, None)) is not None:
+            if timer is not asyncio.current_task():
+                timer.cancel()
 
-        # short press
-        func = getattr(self, f"button_{button+1}", self.default_action)
-        await func()
-        return
+    def reset_presses(self):
+        """
+        Forget the keys held on the page.
+
+        Called when the page stops being the active page, so a key held
+        down does not run an action of a page that is not displayed.
+        """
+        for timer in self._long_press_timers.values():
+            if timer is not asyncio.current_task():
+                timer.cancel()
+        self._long_press_timers.clear()
+        self._pressed.clear()
+        self._handled.clear()
+
+    async def _long_press_timer(self, button):
+        """
+        Run the long press action once the key has been held long enough.
+        """
+        await asyncio.sleep(self.pressed_threshold)
+        async with self._lock:
+            if self._long_press_timers.get(button) is not asyncio.current_task():
+                return
+            del self._long_press_timers[button]
+            # The release of the key does nothing once it is forgotten
+            self._pressed.pop(button, None)
+            if self.controller.page_stack.current_page() is not self:
+                return
+
+        LOGGER.info("Long press detected")
+        # Nothing awaits the timer, so errors have to be logged here
+        try:
+            await self._call_handler(self._long_handlers, button)
+        except Exception:
+            LOGGER.exception(f"Error handling long press of button {button}")
 
     async def setup(self):
         """
         Setup function called when the page is loaded.
+
+        This runs before the page is first painted, so it should only
+        set up the state of the page. Anything that waits on external
+        services belongs in connect.
+        """
+        pass
+
+    async def connect(self):
+        """
+        Connect to external services, called in the background once
+        the page has been painted.
+
+        The page is displayed before this completes, so it should
+        render a disconnected state until its services are up, and
+        request an update of the deck when they are.
         """
         pass
 
@@ -155,60 +450,96 @@ class Page(metaclass=PageMeta):
 
     async def heartbeat(self):
         """
-        Called periodically by the controller, according to the
+        Called periodically by the page stack, according to the
         heartbeat time class attribute.
 
         Used to periodically update the page attributes according
-        to the system environment.
+        to the system environment. Pages that do not override this
+        have no heartbeat.
         """
-        while True:
-            try:
-                await asyncio.sleep(self.heartbeat_time)
-            except asyncio.CancelledError:
-                break
+        pass
+
+    def heartbeat_delay(self) -> float:
+        """
+        Seconds until the next heartbeat while the page is active.
+        """
+        return self.heartbeat_time
 
     @cache
-    async def get_font(self, font: str, size: int) -> ImageFont.ImageFont:
+    async def get_font(self, font: str, size: int) -> "ImageFont.ImageFont":
         """
         Load the font from file with the given size, return the
         font as n ImageFont.
         """
         font_path = self.asset_path / "fonts" / font
-        return ImageFont.truetype(str(font_path), size)
+        return load_font(str(font_path), size)
 
-    @cache
     async def render_image_from_file(self, icon: str, label: str):
         """
         Render the image from file into an image with optional label.
 
-        this funckwargstion code is based on the render helper function from the
-        python-elgato-streamdeck example code.
+        The image is rendered in the render pool, so the images for
+        several keys are rendered concurrently. Images are cached for
+        the key format of the deck, so decks with different key sizes
+        or formats never share images.
+
+        Images compiled into the asset bundle are served from the
+        bundle without rendering.
 
         Missing icons are not rendered.
         """
-        image = PILHelper.create_image(self.controller.deck)
+        key_format = KeyFormat.from_deck(self.controller.deck)
 
-        if icon:
-            icon_path = self.asset_path / "icons" / icon
+        bundle = load_bundle(self.asset_path / BUNDLE_NAME)
+        if bundle is not None:
+            image = bundle.get(key_format, icon, label, self.label_font)
+            if image is not None:
+                return image
 
-            if icon_path.is_file():
-                LOGGER.info(f"Rendering icon {icon}")
-                icon_image = Image.open(str(icon_path)).convert("RGBA")
-                icon_image.thumbnail((image.width, image.height - 20), Image.LANCZOS)
-                icon_pos = ((image.width - icon_image.width) // 2, 0)
-                image.paste(icon_image, icon_pos, icon_image)
-            else:
-                LOGGER.warning(f"Icon {icon} cannot be found")
+        icon_path = str(self.asset_path / "icons" / icon) if icon else None
+        font_path = str(self.asset_path / "fonts" / self.label_font)
+
+        image_key = (key_format, icon_path, label, font_path)
+        if image_key not in self._image_keys:
+            self._image_keys.add(image_key)
+            _IMAGE_REFS[image_key] = _IMAGE_REFS.get(image_key, 0) + 1
 
-        if label:
-            LOGGER.debug("Getting font and rendering label")
-            draw = ImageDraw.Draw(image)
-            font = await self.get_font(self.label_font, 14)
-            label_w, _ = draw.textsize(label, font=font)
-            label_pos = ((image.width - label_w) // 2, image.height - 20)
-            draw.text(label_pos, text=label, font=font, fill="white")
+        return await self._render_key_image(*image_key)
+
+    def memory_usage(self) -> int:
+        """
+        Approximate bytes of cached images used by this page.
+
+        Images shared with other pages are counted for each page.
+        """
+        lru = Page._render_key_image.cache
+        return sum(lru.nbytes(key) for key in self._image_keys)
+
+    def release_images(self):
+        """
+        Drop the cached images used only by this page.
+        """
+        lru = Page._render_key_image.cache
+        for key in self._image_keys:
+            if (refs := _IMAGE_REFS.get(key, 0) - 1) > 0:
+                _IMAGE_REFS[key] = refs
+            else:
+                _IMAGE_REFS.pop(key, None)
+                lru.discard(key)
+        self._image_keys.clear()
 
-        return PILHelper.to_native_format(self.controller.deck, image)
+    @cache
+    async def _render_key_image(self, key_format: KeyFormat,
+                                icon_path: Optional[str],
+                                label: Optional[str],
+                                font_path: str) -> bytes:
+        return await run_in_pool(
+            render_key_image,
+            key_format,
+            icon_path,
+            label,
+            font_path
+        )
 
     async def render(self):
         """
@@ -218,6 +549,53 @@ class Page(metaclass=PageMeta):
         """
         pass
 
+    async def render_key(self, key: int) -> bytes:
+        """
+        Render the image of a single key.
+
+        Pages whose keys can be rendered separately override this, so
+        a state change only renders the keys it affects.
+        """
+        return (await self.render())[key]
+
+    async def render_keys(self, keys: Iterable[int]) -> Dict[int, bytes]:
+        """
+        Render the images of the given keys.
+        """
+        keys = sorted(keys)
+        if type(self).render_key is Page.render_key:
+            # No per key rendering, render the page once for all keys
+            images = await self.render()
+            return {key: images[key] for key in keys}
+        images = await asyncio.gather(*(self.render_key(key) for key in keys))
+        return dict(zip(keys, images))
+
+    def state_keys(self, name: str, keys: FrozenSet[int]) -> FrozenSet[int]:
+        """
+        Get the keys that depend on a state field, given the keys the
+        field declares.
+        """
+        return keys
+
+    def invalidate_keys(self, keys: Iterable[int]):
+        """
+        Re-render and update the given keys, if the page is active.
+
+        The update runs in the background, and all keys invalidated
+        before it runs are updated together.
+        """
+        self._dirty_keys.update(keys)
+        if self._dirty_keys and self._dirty_task is None:
+            self._dirty_task = asyncio.ensure_future(self._update_dirty_keys())
+
+    async def _update_dirty_keys(self):
+        keys, self._dirty_keys = self._dirty_keys, set()
+        self._dirty_task = None
+        try:
+            await self.controller.maybe_update_keys(self, keys)
+        except Exception as e:
+            LOGGER.error(f"Failed to update keys {sorted(keys)} of {self}: {e}")
+
     def get_background_jobs(self) -> List[asyncio.Task]:
         """
         Get a list of the background tasks launched by 
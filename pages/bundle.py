@@ -0,0 +1,200 @@
+import functools
+import importlib
+import json
+import logging
+import mmap
+import os
+import pathlib
+import struct
+import tempfile
+
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Type
+
+from .render import KeyFormat, RENDER_VERSION, get_render_pool, render_key_image
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+BUNDLE_MAGIC = b"SDBUNDL1"
+BUNDLE_NAME = "bundle.sdb"
+
+# magic, render version, length of the JSON index
+_HEADER = struct.Struct("<8sII")
+
+# Deck types compiled for pages that do not name a specific deck.
+GENERIC_DECK_TYPES = (
+    "StreamDeckMini",
+    "StreamDeckOriginal",
+    "StreamDeckOriginalV2",
+    "StreamDeckXL",
+)
+
+MAX_KEYS = 32
+
+
+def key_format_for_deck_type(deck_type: str) -> KeyFormat:
+    """
+    Get the key format of a deck type without a connected device.
+
+    The deck type is the name of a device class in StreamDeck.Devices.
+    """
+    module = importlib.import_module(f"StreamDeck.Devices.{deck_type}")
+    device_class = getattr(module, deck_type)
+    return KeyFormat(
+        (device_class.KEY_PIXEL_WIDTH, device_class.KEY_PIXEL_HEIGHT),
+        device_class.KEY_IMAGE_FORMAT,
+        tuple(device_class.KEY_FLIP),
+        device_class.KEY_ROTATION
+    )
+
+
+def entry_key(key_format: KeyFormat, icon: Optional[str],
+              label: Optional[str], font: str) -> str:
+    return repr((tuple(key_format), icon, label, font))
+
+
+def page_images(page_class: Type) -> Iterator[Tuple[Optional[str], Optional[str]]]:
+    """
+    Get the icon and label pairs referenced by a page class.
+
+    Labels and icons that vary with the state of the page are given
+    as dictionaries, and produce one pair for each state.
+    """
+    for i in range(1, MAX_KEYS + 1):
+        icon = getattr(page_class, f"button_{i}_icon", None)
+        label = getattr(page_class, f"button_{i}_label", None)
+
+        if not isinstance(icon, dict) and not isinstance(label, dict):
+            yield icon, label
+            continue
+
+        states = set(icon) if isinstance(icon, dict) else set()
+        states |= set(label) if isinstance(label, dict) else set()
+        for state in states:
+            yield (
+                icon.get(state) if isinstance(icon, dict) else icon,
+                label.get(state) if isinstance(label, dict) else label
+            )
+
+
+class AssetBundle:
+    """
+    Packed file of pre-rendered key images.
+
+    The bundle is memory-mapped and images are served as memoryview
+    slices of the map, so lookups do not copy or decode anything.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, index_len = _HEADER.unpack_from(self._map, 0)
+        if magic != BUNDLE_MAGIC:
+            raise ValueError(f"{path} is not an asset bundle")
+        if version != RENDER_VERSION:
+            raise ValueError(f"Asset bundle {path} is out of date")
+
+        start = _HEADER.size
+        index = json.loads(self._map[start:start + index_len])
+        self._data_start = start + index_len
+        self._index: Dict[str, Tuple[int, int]] = {
+            key: (offset, length) for key, (offset, length) in index.items()
+        }
+        self._view = memoryview(self._map)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get(self, key_format: KeyFormat, icon: Optional[str],
+            label: Optional[str], font: str) -> Optional[memoryview]:
+        """
+        Get the native image for an icon and label, if it is bundled.
+        """
+        if (entry := self._index.get(entry_key(key_format, icon, label, font))) is None:
+            return None
+        offset, length = entry
+        start = self._data_start + offset
+        return self._view[start:start + length]
+
+
+@functools.lru_cache(maxsize=None)
+def load_bundle(path: pathlib.Path) -> Optional[AssetBundle]:
+    """
+    Load the asset bundle at path, or None if there is no usable bundle.
+    """
+    if not path.is_file():
+        return None
+    try:
+        bundle = AssetBundle(path)
+    except (OSError, ValueError) as e:
+        LOGGER.warning(f"Cannot load asset bundle: {e}")
+        return None
+    LOGGER.info(f"Loaded {len(bundle)} images from asset bundle {path}")
+    return bundle
+
+
+def build_bundle(page_classes: Iterable[Type],
+                 path: pathlib.Path,
+                 deck_types: Optional[List[str]] = None) -> int:
+    """
+    Render every image referenced by the pages into a bundle at path.
+
+    Images are rendered for the deck type of each page, or for the
+    given deck types if any. Returns the number of images bundled.
+    """
+    jobs: Set[Tuple[KeyFormat, Optional[str], Optional[str], str,
+                    Optional[str], str]] = set()
+    for page_class in page_classes:
+        if deck_types:
+            types = deck_types
+        elif page_class.deck_type in GENERIC_DECK_TYPES:
+            types = [page_class.deck_type]
+        else:
+            types = list(GENERIC_DECK_TYPES)
+
+        asset_path = page_class.asset_path
+        font = page_class.label_font
+        for deck_type in types:
+            key_format = key_format_for_deck_type(deck_type)
+            for icon, label in page_images(page_class):
+                icon_path = str(asset_path / "icons" / icon) if icon else None
+                font_path = str(asset_path / "fonts" / font)
+                jobs.add((key_format, icon, label, font, icon_path, font_path))
+
+    jobs_list = sorted(jobs, key=repr)
+    LOGGER.info(f"Rendering {len(jobs_list)} images for asset bundle")
+    images = get_render_pool().map(
+        render_key_image,
+        [job[0] for job in jobs_list],
+        [job[4] for job in jobs_list],
+        [job[2] for job in jobs_list],
+        [job[5] for job in jobs_list]
+    )
+
+    index = {}
+    data = []
+    offset = 0
+    for (key_format, icon, label, font, *_), image in zip(jobs_list, images):
+        index[entry_key(key_format, icon, label, font)] = (offset, len(image))
+        data.append(image)
+        offset += len(image)
+
+    index_bytes = json.dumps(index).encode("utf-8")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_HEADER.pack(BUNDLE_MAGIC, RENDER_VERSION, len(index_bytes)))
+            f.write(index_bytes)
+            f.writelines(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+    load_bundle.cache_clear()
+    return len(index)
@@ -3,11 +3,11 @@ import datetime
 import traceback
 import logging
 
-from PIL import Image, ImageDraw, ImageFont
-from StreamDeck.ImageHelpers import PILHelper
-
-from .base import Page, cache
+from .base import Page
 from .commands import BackAction
+from .render import KeyFormat, render_number_image, run_in_pool
+
+from typing import Dict, List, Tuple
 
 LOGGER = logging.getLogger(__name__)
 
@@ -16,16 +16,62 @@ MINUTE_KEY = 1
 HOUR_KEY = 0
 
 
-async def wait_for_next_minute(ref_time):
+class DigitAtlas:
     """
-    Wait until the next clock minute relative to a reference time.
+    Images of the numbers 00 to 99 for one key format and font.
+
+    The images are packed into a single buffer and served as memoryview
+    slices, so an atlas is cheap to share between pages and decks.
     """
-    time_now = datetime.datetime.now()
-    LOGGER.debug(f"Time now {time_now}, relative time {ref_time}")
-    if time_now.minute == ref_time.minute:
-        LOGGER.debug(f"Sleeping for {60 - time_now.second} seconds")
-        await asyncio.sleep(60 - time_now.second)
-    return time_now
+
+    def __init__(self, images: List[bytes]):
+        self._offsets = [0]
+        for image in images:
+            self._offsets.append(self._offsets[-1] + len(image))
+        self._buffer = memoryview(b"".join(images))
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, number: int) -> memoryview:
+        return self._buffer[self._offsets[number]:self._offsets[number + 1]]
+
+
+_ATLASES: "Dict[Tuple[KeyFormat, str, int], asyncio.Future]" = {}
+
+
+async def _render_digit_atlas(key_format: KeyFormat,
+                              font_path: str,
+                              size: int) -> DigitAtlas:
+    LOGGER.info(f"Rendering digit atlas for {key_format}")
+    images = await asyncio.gather(*(
+        run_in_pool(render_number_image, key_format, number, font_path, size)
+        for number in range(100)
+    ))
+    return DigitAtlas(images)
+
+
+async def get_digit_atlas(key_format: KeyFormat,
+                          font_path: str,
+                          size: int) -> DigitAtlas:
+    """
+    Get the digit atlas for a key format and font, rendering it once.
+
+    All 100 numbers are rendered concurrently in the render pool.
+    Concurrent requests for the same atlas wait for a single render.
+    """
+    key = (key_format, font_path, size)
+    if (future := _ATLASES.get(key)) is None:
+        future = _ATLASES[key] = asyncio.ensure_future(
+            _render_digit_atlas(key_format, font_path, size)
+        )
+    try:
+        return await asyncio.shield(future)
+    except Exception:
+        # Do not keep a failed render, so it is tried again.
+        if _ATLASES.get(key) is future:
+            del _ATLASES[key]
+        raise
 
 
 class ClockPage(Page):
@@ -36,6 +82,7 @@ class ClockPage(Page):
     deck_type = "StreamDeckMini"
 
     heartbeat_time = 60
+    clock_font_size = 50
 
     button_6_label = "Back"
 
@@ -46,24 +93,24 @@ class ClockPage(Page):
         
         self._last = None
 
-    @cache
-    async def render_clock_number(self, number: int) -> Image.Image:
-    
-        LOGGER.info(f"Rendering number {number}")
-        image = PILHelper.create_image(self.controller.deck)
-
-        text = f"{number:02d}"
-
-        font = await self.get_font(self.label_font, 50)
-        draw = ImageDraw.Draw(image)
-        w, _h = draw.textsize(text, font=font)
+    async def setup(self):
+        """
+        Render the digit atlas for the deck before the page is shown.
+        """
+        await self.get_atlas()
+
+    async def get_atlas(self) -> "DigitAtlas":
+        font_path = str(self.asset_path / "fonts" / self.label_font)
+        return await get_digit_atlas(
+            KeyFormat.from_deck(self.controller.deck),
+            font_path,
+            self.clock_font_size
+        )
 
-        h_pos = image.height // 8
-        pos = ((image.width - w) // 2, h_pos)
-        draw.text(pos, text=text, font=font, fill="white")
+    async def render_clock_number(self, number: int) -> memoryview:
+        atlas = await self.get_atlas()
+        return atlas[number]
 
-        return PILHelper.to_native_format(self.controller.deck, image)
-        
     async def render(self):
         now = datetime.datetime.now()
         hour = now.hour
@@ -89,50 +136,33 @@ class ClockPage(Page):
 
     button_6 = BackAction()
 
-    async def heartbeat(self):
-        render_num = self.render_clock_number
-        ref_time = datetime.datetime.now()
-        next_minute_image = None
-        next_hour_image = None
-
-        LOGGER.debug("Entering heartbeat loop")
-        while True:
-            try:
-                minute = ref_time.minute + 1
-                next_minute = minute % 60
-
-                update_hour = minute // 60
-                next_hour = (ref_time.hour + update_hour) % 24
-                LOGGER.debug(f"Heartbeat: {next_minute=}, {next_hour=}")
-
-                next_minute_image = await render_num(next_minute)
-                LOGGER.debug(f"Rendering minute {next_minute}")
-                if update_hour:
-                    LOGGER.debug(f"Rendering hour {next_hour}")
-                    next_hour_image = await render_num(next_hour)
-
-                ref_time = await wait_for_next_minute(ref_time)
-
-
-                if ref_time.hour == 23 and ref_time.minute == 59:
-                    await self.controller.maybe_update_deck(self)
-                    continue
-
-                LOGGER.debug("Rendering next minute")
-                await self.controller.maybe_update_key(
-                    self, MINUTE_KEY, next_minute_image
-                )
-
-                if update_hour:
-                    LOGGER.debug("Rendering next hour")
-                    await self.controller.maybe_update_key(
-                        self, HOUR_KEY, next_hour_image
-                    )
-            except asyncio.CancelledError:
-                break
-
-
-            
+    def heartbeat_delay(self):
+        # Beat just after the start of each minute
+        now = datetime.datetime.now()
+        return 60 - now.second - now.microsecond / 1e6 + 0.01
 
+    async def heartbeat(self):
+        """
+        Update the keys that changed since the clock was last rendered.
+        """
+        now = datetime.datetime.now()
+        async with self._lock:
+            last = self._last
 
+        if last is None or last.date() != now.date():
+            await self.controller.maybe_update_deck(self)
+            return
 
+        atlas = await self.get_atlas()
+        async with self._lock:
+            self._last = now
+        if now.minute != last.minute:
+            LOGGER.debug(f"Rendering minute {now.minute}")
+            await self.controller.maybe_update_key(
+                self, MINUTE_KEY, atlas[now.minute]
+            )
+        if now.hour != last.hour:
+            LOGGER.debug(f"Rendering hour {now.hour}")
+            await self.controller.maybe_update_key(
+                self, HOUR_KEY, atlas[now.hour]
+            )
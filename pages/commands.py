@@ -1,32 +1,29 @@
 
 
 import abc
-import asyncio
-from asyncio.subprocess import DEVNULL
-
 import logging
 
+from launcher import command_argv, get_launcher
+
 LOGGER = logging.getLogger(__name__)
 
 
-async def launch_shell(self, cmd):
-    LOGGER.info(f"Invoking shell command {cmd}")
-    await asyncio.create_subprocess_shell(
-                cmd=cmd,
-                stderr=DEVNULL,
-                stdout=DEVNULL,
-                stdin=DEVNULL
-          )
-
-async def launch_process(self, app, *args):
-    LOGGER.info(f"Starting application {app}")
-    await asyncio.create_subprocess_exec(
-                program=app,
-                args=args,
-                stderr=DEVNULL,
-                stdout=DEVNULL,
-                stdin=DEVNULL
-          ) 
+async def launch_shell(self, cmd, **options):
+    """
+    Run a command line, without a shell unless it uses shell syntax.
+
+    Options are passed to Launcher.launch.
+    """
+    get_launcher().launch(command_argv(cmd), **options)
+
+
+async def launch_process(self, app, *args, **options):
+    """
+    Start an application in the background.
+
+    Options are passed to Launcher.launch.
+    """
+    get_launcher().launch((app, *args), **options)
 
 
 class MultiAction(abc.ABC):
@@ -0,0 +1,98 @@
+import hashlib
+import logging
+import os
+import pathlib
+import tempfile
+
+from typing import Optional, Tuple
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+DISK_CACHE_ENV = "STREAMDECK_CACHE_DIR"
+
+
+def default_cache_dir() -> pathlib.Path:
+    """
+    Directory of the render cache.
+
+    This is STREAMDECK_CACHE_DIR if set, otherwise a directory under
+    the XDG cache directory.
+    """
+    if (path := os.environ.get(DISK_CACHE_ENV)):
+        return pathlib.Path(path).expanduser()
+    xdg = os.environ.get("XDG_CACHE_HOME") or "~/.cache"
+    return pathlib.Path(xdg).expanduser() / "streamdeck" / "render"
+
+
+def file_signature(path: Optional[str]) -> "Optional[Tuple[str, int, int]]":
+    """
+    Identify the contents of a file by its path, size and mtime.
+
+    Returns None if there is no file, so a missing file and a file that
+    is created later have different signatures.
+    """
+    if not path:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (path, stat.st_size, stat.st_mtime_ns)
+
+
+class DiskCache:
+    """
+    Content addressed cache of rendered images stored on disk.
+
+    Entries are addressed by a digest of everything that determines the
+    rendered image, so entries never need to be invalidated; a change
+    to an input simply produces a different address. Writes are atomic,
+    so several processes can share the cache.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+
+    @staticmethod
+    def key(*parts) -> str:
+        """
+        Compute the address of an entry from its inputs.
+
+        The parts must have a stable repr.
+        """
+        return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str) -> pathlib.Path:
+        return self.path / key[:2] / f"{key}.bin"
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Get the data stored for a key, or None if there is none.
+        """
+        try:
+            return self._entry_path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            LOGGER.warning(f"Cannot read render cache entry {key}: {e}")
+            return None
+
+    def put(self, key: str, data: bytes):
+        """
+        Store the data for a key.
+        """
+        path = self._entry_path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        except OSError as e:
+            LOGGER.warning(f"Cannot write render cache entry {key}: {e}")
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import sys
+
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, NamedTuple, Optional
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    nbytes: int
+    maxsize: Optional[int]
+    maxbytes: Optional[int]
+
+
+def sizeof(value: Any) -> int:
+    """
+    Approximate memory used by a cached value.
+
+    Native images are bytes, so this is exact for the render caches.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+class AsyncLRUCache:
+    """
+    Bounded least-recently-used cache for the results of coroutines.
+
+    The cache is bounded by both the number of entries and the total
+    size of the cached values, the least recently used entries are
+    evicted when either budget is exceeded. Concurrent requests for the
+    same key wait for a single computation, while requests for
+    different keys are computed in parallel.
+    """
+
+    _entries: "OrderedDict[Hashable, Any]"
+    _sizes: Dict[Hashable, int]
+    _inflight: "Dict[Hashable, asyncio.Future]"
+
+    def __init__(self,
+                 maxsize: Optional[int] = 256,
+                 maxbytes: Optional[int] = None,
+                 name: str = "cache"):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.name = name
+
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._inflight = {}
+        self._nbytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def info(self) -> CacheInfo:
+        """
+        Get the hit, miss and eviction counters and the cache usage.
+        """
+        return CacheInfo(
+            self.hits,
+            self.misses,
+            self.evictions,
+            len(self._entries),
+            self._nbytes,
+            self.maxsize,
+            self.maxbytes
+        )
+
+    def nbytes(self, key) -> int:
+        """
+        Size of the value cached for a key, 0 if it is not cached.
+        """
+        return self._sizes.get(key, 0)
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        self._entries.clear()
+        self._sizes.clear()
+        self._nbytes = 0
+
+    def discard(self, key):
+        """
+        Remove an entry from the cache if it is present.
+        """
+        if key in self._entries:
+            del self._entries[key]
+            self._nbytes -= self._sizes.pop(key)
+
+    def put(self, key, value):
+        """
+        Insert a value into the cache, evicting old entries as needed.
+        """
+        self.discard(key)
+        size = sizeof(value)
+        self._entries[key] = value
+        self._sizes[key] = size
+        self._nbytes += size
+        self._evict()
+
+    def _evict(self):
+        while self._entries and (
+                (self.maxsize is not None and len(self._entries) > self.maxsize)
+                or (self.maxbytes is not None and self._nbytes > self.maxbytes)):
+            key, _ = self._entries.popitem(last=False)
+            self._nbytes -= self._sizes.pop(key)
+            self.evictions += 1
+            LOGGER.debug(f"Evicted {key} from {self.name}")
+
+    async def get_or_compute(self, key, compute: Callable[[], Awaitable]):
+        """
+        Get the value for a key, computing it if it is not cached.
+
+        If the value is already being computed, wait for that
+        computation rather than starting another.
+        """
+        while True:
+            if key in self._entries:
+                LOGGER.debug(f"Loading {key} from {self.name}")
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+            future = self._inflight.get(key)
+            if future is None:
+                break
+
+            self.hits += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The computation we were waiting on was cancelled,
+                # try again and compute the value ourselves.
+                self.hits -= 1
+
+        LOGGER.debug(f"Computing {key} for {self.name}")
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved, it is raised here.
+            future.exception()
+            raise
+        else:
+            self.put(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self._inflight[key]
@@ -1,12 +1,8 @@
 import asyncio
 import logging
 
-import simpleobsws as obs
-
-from .base import Page, create_action_method
+from .base import Page, StateField, create_action_method
 from .commands import launch_shell
-from .menu import MainMenuPage
-from .clock import ClockPage
 
 LOGGER = logging.getLogger(__name__)
 
@@ -18,11 +14,14 @@ class MainPage(Page):
 
     deck_type = "StreamDeckMini"
 
+    navigation_targets = ("ClockPage", "MainMenuPage")
+
     button_1_label = "Terminal"
     button_2_label = "Clock"
     button_3_label = "Mute"
     button_4_label = "Menu"
     button_5_label = {
+        "disconnected": "Connect OBS",
         "stopped": "Start/Record",
         "recording": "Pause",
         "paused": "Resume"
@@ -34,124 +33,74 @@ class MainPage(Page):
     button_3_icon = "mic-on.png"
     button_4_icon = "navigation.png"
     button_5_icon = {
+        "disconnected": "play-record.png",
         "stopped": "play-record.png",
         "recording": "play-pause.png",
         "paused": "play-record.png"        
     }
     button_6_icon = "play-stop.png"
 
+    # Only the record button shows the OBS state. Until OBS answers
+    # the page is painted as disconnected.
+    obs_state = StateField("disconnected", buttons=(5,))
+
     def __init__(self, controller):
         super().__init__(controller)
 
-        self.obs_state = "stopped"
-        self.obs_ws = None
-        
-    async def render(self):
+        self.obs = None
 
+    async def render_key(self, key):
         async with self._lock:
             obs_state = self.obs_state
 
-        button_1_label = self.button_1_label
-        button_2_label = self.button_2_label
-        button_3_label = self.button_3_label
-        button_4_label = self.button_4_label
-        button_5_label = self.button_5_label[obs_state]
-        button_6_label = self.button_6_label
-
-        button_1_icon = self.button_1_icon
-        button_2_icon = self.button_2_icon
-        button_3_icon = self.button_3_icon
-        button_4_icon = self.button_4_icon
-        button_5_icon = self.button_5_icon[obs_state]
-        button_6_icon = self.button_6_icon
-
-        return await asyncio.gather(
-            self.render_image_from_file(button_1_icon, button_1_label),
-            self.render_image_from_file(button_2_icon, button_2_label),
-            self.render_image_from_file(button_3_icon, button_3_label),
-            self.render_image_from_file(button_4_icon, button_4_label),
-            self.render_image_from_file(button_5_icon, button_5_label),
-            self.render_image_from_file(button_6_icon, button_6_label)
-        )
-
-    async def setup(self):
-        LOGGER.info(f"Running page {self} setup")
-        self.obs_ws = ws = obs.obsws(loop=self.controller.loop)
-        ws.register(self.connection_lost_callback, "Exiting")
-        ws.register(self.recording_started_callback, "RecordingStarted")
-        ws.register(self.recording_paused_callback, "RecordingPaused")
-        ws.register(self.recording_stopped_callback, "RecordingStopping")
-        await self.connect_obs()
+        label = getattr(self, f"button_{key + 1}_label", None)
+        icon = getattr(self, f"button_{key + 1}_icon", None)
+        if isinstance(label, dict):
+            label = label[obs_state]
+        if isinstance(icon, dict):
+            icon = icon[obs_state]
+        return await self.render_image_from_file(icon, label)
+
+    async def render(self):
+        return await asyncio.gather(*(self.render_key(key) for key in range(6)))
+
+    async def connect(self):
+        LOGGER.info(f"Connecting page {self} to OBS")
+        # The OBS client pulls in simpleobsws and websockets, so it is
+        # only loaded once the deck has been painted
+        from obsclient import get_client
+
+        # The connection is shared with the main pages of other decks
+        self.obs = get_client()
+        self.obs_state = self.obs.status
+        self.obs.subscribe(self.obs_status_changed)
+        self.obs.start()
+
+    async def clean_up(self):
+        if self.obs is not None:
+            self.obs.unsubscribe(self.obs_status_changed)
 
     async def obs_call(self, cmd, data=None):
-        ws = self.obs_ws
-        LOGGER.debug(f"Calling OBS command {cmd}")
+        from obsclient import OBSError
+
+        if self.obs is None:
+            LOGGER.error(f"OBS error: {cmd} before connecting to OBS")
+            return
         try:
-            result = await ws.call(cmd, data)
-        except obs.ConnectionFailure:
-            LOGGER.error("Connection to OBS failed")
-        except obs.MessageTimeout:
-            LOGGER.error("Connection to OBS timed out")
-        except obs.MessageFormatError:
-            LOGGER.error("Incorrect OBS message format")
-        else:
-            if result["status"] == "error":
-                LOGGER.error(f"OBS error: {result['error']}")
-
-    async def connect_obs(self):
+            await self.obs.call(cmd, data)
+        except OBSError as e:
+            LOGGER.error(f"OBS error: {e}")
+
+    async def obs_status_changed(self, client):
         """
-        Connect to the OBS web socket
+        Called by the OBS client when the connection or the recording
+        state changes.
         """
-        try:
-            await self.obs_ws.connect()
-            LOGGER.info("Connected to OBS")
-            return True
-        except ConnectionError:
-            LOGGER.info("Connection to OBS failed")
-        return False
-
-    async def obs_conn_alive(self):
-        try:
-            return self.obs_ws.recv_task is not None
-        except Exception as e:
-            LOGGER.error(e)
-            return False
-
-    async def heartbeat(self):
-        LOGGER.warning("Starting heartbeat")
-        while True:
-            try:
-                await asyncio.sleep(self.heartbeat_time)
-                LOGGER.debug("Running main menu heartbeat")
-                if not await self.obs_conn_alive():
-                    await self.connect_obs()
-            except asyncio.CancelledError:
-                break
-
-    async def connection_lost_callback(self, data=None):
-        LOGGER.info("OBS connection lost event callback")
-        async with self._lock:
-            await self.obs_ws.disconnect()
-            self.obs_state = "stopped"
-        await self.controller.update_deck()
-
-    async def recording_started_callback(self, data=None):
-        async with self._lock:
-            LOGGER.info("Recording started event callback")
-            self.obs_state = "recording"
-        await self.controller.update_deck()
-
-    async def recording_paused_callback(self, data=None):
-        async with self._lock:
-            LOGGER.info("Recording paused event callback")
-            self.obs_state = "paused"
-        await self.controller.update_deck()
-
-    async def recording_stopped_callback(self, data=None):
         async with self._lock:
-            LOGGER.info("Recording stopped event callback")
-            self.obs_state = "stopped"
-        await self.controller.update_deck()
+            if self.obs_state != client.status:
+                LOGGER.info(f"OBS state changed to {client.status}")
+                # Updates the record button
+                self.obs_state = client.status
 
     button_1 = create_action_method(launch_shell, "gnome-terminal")
     alt_button_1 = button_1
@@ -161,7 +110,7 @@ class MainPage(Page):
         Display clock page
         """
         LOGGER.info("Loading clock page")
-        await self.controller.set_next_page(ClockPage)
+        await self.controller.set_next_page("ClockPage")
 
     alt_button_2 = button_2
 
@@ -178,7 +127,7 @@ class MainPage(Page):
         Open main menu page
         """
         LOGGER.info("Loading menu page")
-        await self.controller.set_next_page(MainMenuPage)
+        await self.controller.set_next_page("MainMenuPage")
 
     alt_button_4 = button_4
 
@@ -193,7 +142,11 @@ class MainPage(Page):
             state = self.obs_state
 
         LOGGER.debug(f"Current OBS state {state}")
-        if state == "stopped":
+        if state == "disconnected":
+            if self.obs is not None:
+                LOGGER.info("Reconnecting to OBS")
+                self.obs.reconnect_now()
+        elif state == "stopped":
             LOGGER.info("Starting OBS recording")
             await self.obs_call("StartRecording")
         elif state == "paused":
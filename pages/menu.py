@@ -2,8 +2,7 @@ import asyncio
 import logging
 
 from .base import StreamDeckMiniPage, create_action_method
-from .commands import launch_shell, launch_process, BackAction
-from .settings import SettingsPage
+from .commands import launch_process, BackAction
 
 
 LOGGER = logging.getLogger(__name__)
@@ -16,6 +15,8 @@ class MainMenuPage(StreamDeckMiniPage):
 
     deck_type = "StreamDeckMini"
 
+    navigation_targets = ("SettingsPage",)
+
     button_1_label = "Steam"
     button_2_label = "Messenger"
     button_3_label = "Mail"
@@ -30,14 +31,19 @@ class MainMenuPage(StreamDeckMiniPage):
     button_5_icon = "settings.png"
     button_6_icon = "close.png"
 
-    button_1 = create_action_method(launch_shell, "steam")
-    button_2 = create_action_method(launch_shell, "caprine")   
-    button_3 = create_action_method(launch_shell, "evolution")
-    button_4 = create_action_method(launch_shell, "gnome-system-monitor") 
+    # Raise the window of an application that is already running
+    # rather than starting another one
+    button_1 = create_action_method(launch_process, "steam", single=True, focus="steam")
+    button_2 = create_action_method(launch_process, "caprine", single=True, focus="caprine")
+    button_3 = create_action_method(launch_process, "evolution", single=True, focus="evolution")
+    button_4 = create_action_method(
+        launch_process, "gnome-system-monitor",
+        single=True, focus="gnome-system-monitor"
+    )
 
     async def button_5(self):
         LOGGER.info("Changing to settings page.")
-        await self.controller.set_next_page(SettingsPage)
+        await self.controller.set_next_page("SettingsPage")
 
     button_6 = BackAction()
 
@@ -0,0 +1,98 @@
+import logging
+
+from collections import OrderedDict
+from typing import Callable, Iterator, List, Optional
+
+from pages.base import Page
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class PageCache:
+    """
+    Page instances of a controller, by page name.
+
+    Pages are kept so their state and images survive navigating away
+    and back, within a budget of the number of pages and the bytes of
+    cached images they use. When the budget is exceeded, the least
+    recently used pages that are not pinned, normally because they are
+    on the page stack, are evicted.
+    """
+
+    _pages: "OrderedDict[str, Page]"
+
+    def __init__(self,
+                 maxsize: Optional[int] = 16,
+                 maxbytes: Optional[int] = None,
+                 pinned: Callable[[Page], bool] = lambda page: False):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.pinned = pinned
+
+        self._pages = OrderedDict()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._pages
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._pages)
+
+    def __getitem__(self, name: str) -> Page:
+        page = self._pages[name]
+        self._pages.move_to_end(name)
+        return page
+
+    def __setitem__(self, name: str, page: Page):
+        self._pages[name] = page
+        self._pages.move_to_end(name)
+
+    def get(self, name: str) -> Optional[Page]:
+        if name not in self._pages:
+            return None
+        return self[name]
+
+    def pages(self) -> List[Page]:
+        return list(self._pages.values())
+
+    def nbytes(self) -> int:
+        """
+        Approximate bytes of cached images used by the pages.
+        """
+        return sum(page.memory_usage() for page in self._pages.values())
+
+    def _over_budget(self) -> bool:
+        if self.maxsize is not None and len(self._pages) > self.maxsize:
+            return True
+        return self.maxbytes is not None and self.nbytes() > self.maxbytes
+
+    def has_room(self) -> bool:
+        """
+        Whether another page can be added without exceeding the budget.
+        """
+        if self.maxsize is not None and len(self._pages) >= self.maxsize:
+            return False
+        return self.maxbytes is None or self.nbytes() < self.maxbytes
+
+    def evict(self) -> List[Page]:
+        """
+        Remove pages until the cache is within budget.
+
+        Pinned pages are never removed, so the cache can stay over
+        budget if every page is pinned. Returns the removed pages,
+        which the caller should clean up.
+        """
+        evicted = []
+        for name in list(self._pages):
+            if not self._over_budget():
+                break
+            page = self._pages[name]
+            if self.pinned(page):
+                continue
+            LOGGER.info(f"Evicting page {name} from page cache")
+            del self._pages[name]
+            evicted.append(page)
+        return evicted
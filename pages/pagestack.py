@@ -1,14 +1,17 @@
 
 import asyncio
+import heapq
+import itertools
 import logging
 import inspect
 from enum import Enum
 
 
-from collections import defaultdict
-from typing import Dict, List, Optional, Union, TYPE_CHECKING, DefaultDict
+from typing import (Dict, List, Mapping, NamedTuple, Optional, Tuple, Union,
+                    TYPE_CHECKING)
 
 
+import tracing
 from pages.base import Page
 
 if TYPE_CHECKING:
@@ -31,6 +34,155 @@ class PageState(Enum):
     Active = 2
 
 
+class HeartbeatScheduler:
+    """
+    Runs the heartbeats of the pages of a stack from a single task.
+
+    Pending heartbeats are kept in a heap ordered by due time, and the
+    task sleeps until the earliest one is due, so it does not wake at
+    all while no heartbeat is due. Pages that do not override
+    heartbeat are never scheduled.
+
+    The active page beats every heartbeat_delay() seconds. Loaded pages
+    beat every loaded_heartbeat_time seconds, or are suspended when it
+    is None. A suspended page whose heartbeat fell due while it was
+    hidden beats as soon as it is active again.
+    """
+
+    _heap: List[Tuple[float, int, Page]]
+    # Sequence number of the valid heap entry of each scheduled page
+    _scheduled: Dict[Page, int]
+    # Due time of every page with a pending heartbeat, even if suspended
+    _due: Dict[Page, float]
+    _states: Dict[Page, PageState]
+    _running: Dict[Page, asyncio.Task]
+
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self._scheduled = {}
+        self._due = {}
+        self._states = {}
+        self._running = {}
+        self._wakeup = asyncio.Event()
+        self._task: "Optional[asyncio.Task]" = None
+
+    def _now(self) -> float:
+        return asyncio.get_event_loop().time()
+
+    def _schedule(self, page: Page, due: float):
+        self._due[page] = due
+        self._scheduled[page] = seq = next(self._seq)
+        heapq.heappush(self._heap, (due, seq, page))
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def _unschedule(self, page: Page) -> Optional[float]:
+        # The heap entry is left in place and skipped when it comes up
+        self._scheduled.pop(page, None)
+        return self._due.pop(page, None)
+
+    def set_state(self, page: Page, state: PageState):
+        """
+        Update the heartbeat of a page for its new state.
+        """
+        if type(page).heartbeat is Page.heartbeat:
+            return
+
+        now = self._now()
+        due = self._unschedule(page)
+        if state is PageState.Inactive:
+            self._states.pop(page, None)
+            if (task := self._running.pop(page, None)) is not None:
+                task.cancel()
+            return
+
+        self._states[page] = state
+        if page in self._running:
+            # The next heartbeat is scheduled when this one finishes
+            return
+
+        if state is PageState.Active:
+            # An overdue heartbeat from while the page was suspended
+            # runs straight away, to catch up
+            next_due = now + page.heartbeat_delay()
+            self._schedule(page, next_due if due is None else min(due, next_due))
+        elif page.loaded_heartbeat_time is None:
+            LOGGER.debug(f"Suspending heartbeat of {page}")
+            self._due[page] = now + page.heartbeat_delay() if due is None else due
+        else:
+            next_due = now + page.loaded_heartbeat_time
+            self._schedule(page, next_due if due is None else max(due, next_due))
+
+    def _reschedule(self, page: Page):
+        now = self._now()
+        state = self._states.get(page)
+        if state is PageState.Active:
+            self._schedule(page, now + page.heartbeat_delay())
+        elif state is PageState.Loaded:
+            if page.loaded_heartbeat_time is None:
+                self._due[page] = now + page.heartbeat_delay()
+            else:
+                self._schedule(page, now + page.loaded_heartbeat_time)
+
+    async def _beat(self, page: Page):
+        try:
+            LOGGER.debug(f"Heartbeat of {page}")
+            await page.heartbeat()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            LOGGER.exception(f"Error in heartbeat of {page}")
+        if self._running.get(page) is asyncio.current_task():
+            del self._running[page]
+            self._reschedule(page)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            timeout = None
+            while self._heap:
+                due, seq, page = self._heap[0]
+                if self._scheduled.get(page) != seq:
+                    heapq.heappop(self._heap)
+                    continue
+                timeout = due - self._now()
+                break
+
+            if timeout is None:
+                await self._wakeup.wait()
+            elif timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                heapq.heappop(self._heap)
+                self._unschedule(page)
+                self._running[page] = asyncio.ensure_future(self._beat(page))
+
+    def stop(self):
+        """
+        Stop running heartbeats.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in self._running.values():
+            task.cancel()
+        self._running.clear()
+
+
+class StackSnapshot(NamedTuple):
+    """
+    Immutable state of a page stack.
+    """
+    pages: Tuple[Page, ...]
+    # Number of times each page is on the stack, keyed by identity
+    counts: Mapping[Page, int]
+
+
 class PageStack:
     """
     Holds the currently active pages in a stack and handles heartbeat
@@ -51,94 +203,112 @@ class PageStack:
     The stack will hold a root page that will always be on the stack
     and cannot be removed. This represents the starting or default page
     that should be displayed if a requested page cannot be found.
+
+    The stack is held as an immutable snapshot, replaced whole by
+    every change. Reading the active page or the status of a page only
+    reads the current snapshot, so reads never wait on a lock, and
+    the status of a page is an identity lookup in the snapshot index.
+    Changes to the stack never await, so each one is atomic on the
+    event loop.
     """
 
-    _stack: List[Page]
-    _tasks: DefaultDict[str, List[asyncio.Task]]
+    _snapshot: StackSnapshot
+    _tasks: Dict[Page, List[asyncio.Task]]
 
     def __init__(self, root: Page):
-        self._lock = asyncio.Lock()
         self._root = root
 
-        self._stack = []
-        self._tasks = defaultdict(list)
-        self._push(root)
-
-    def _push(self, page):
-
-        LOGGER.debug(f"Pushing {page} to stack")
-
-        self._stack.append(page)
-        name = page.__class__.__name__
-
-        LOGGER.debug(f"Setting up heartbeat task")
-        task = asyncio.create_task(page.heartbeat())
-        self._tasks[name].append(task)
+        self._snapshot = StackSnapshot((), {})
+        self._tasks = {}
+        self._heartbeats = HeartbeatScheduler()
+        self._replace((root,))
 
-        LOGGER.debug(f"Setting up background tasks")
-        new_tasks = page.get_background_jobs()
-        self._tasks[name].extend(new_tasks)
+    def _replace(self, pages: Tuple[Page, ...]):
+        """
+        Replace the stack, starting and stopping the tasks of the
+        pages that entered and left it.
+        """
+        old = self._snapshot
+        counts: Dict[Page, int] = {}
+        for page in pages:
+            counts[page] = counts.get(page, 0) + 1
+        self._snapshot = StackSnapshot(pages, counts)
+
+        old_top = old.pages[-1] if old.pages else None
+        for page in old.counts:
+            if page not in counts:
+                self._heartbeats.set_state(page, PageState.Inactive)
+                self._cancel_tasks(page)
+        if old_top is not pages[-1]:
+            if old_top is not None:
+                old_top.reset_presses()
+            if old_top in counts:
+                self._heartbeats.set_state(old_top, PageState.Loaded)
+            self._heartbeats.set_state(pages[-1], PageState.Active)
+
+        for page in counts:
+            if page not in old.counts:
+                LOGGER.debug(f"Setting up background tasks for {page}")
+                self._tasks[page] = list(page.get_background_jobs())
+
+    def _cancel_tasks(self, page: Page):
+        for task in self._tasks.pop(page, ()):
+            task.cancel()
+
+    @property
+    def pages(self) -> Tuple[Page, ...]:
+        """
+        The pages on the stack, from the root to the active page.
+        """
+        return self._snapshot.pages
 
-    async def current_page(self):
+    def current_page(self) -> Page:
         """
         Get the active page.
         """
-        LOGGER.debug("Getting active page")
-        async with self._lock:
-            return self._stack[-1]
+        return self._snapshot.pages[-1]
 
-    async def get_status(self, page: Page) -> PageState:
+    def get_status(self, page: Page) -> PageState:
         """
         Determine the status of a page.
 
         This is used to control the updating of the deck according to
         the current state of the page.
         """
-        LOGGER.debug(f"Getting status for page {page}")
-        async with self._lock:
-            if self._stack[-1] is page:
-                # The most important case is when the page is active,
-                # because this means something needs to be done to the
-                # deck in most cases. Do this first.
-                return PageState.Active
-            
-            if page in self._stack:
-                return PageState.Loaded
-            
-            return PageState.Inactive
+        snapshot = self._snapshot
+        if snapshot.pages[-1] is page:
+            return PageState.Active
+        if page in snapshot.counts:
+            return PageState.Loaded
+        return PageState.Inactive
 
     async def push(self, page: Page):
         """
         Push a new page to the stack.
-
-        The name of the page should be provided. 
         """
         LOGGER.debug(f"Pushing page {page} onto stack")
-        async with self._lock:
-
-            if page is self._stack[-1]:
+        with tracing.span("stack_push"):
+            pages = self._snapshot.pages
+            if page is pages[-1]:
                 LOGGER.debug(f"Page {page} currently active")
                 return
+            self._replace(pages + (page,))
 
-            self._push(page)
-
-    async def cancel_jobs_for_page(self, page):
+    def cancel_jobs_for_page(self, page: Union[Page, str]):
         """
-        Cancel all active jobs for a page.
+        Cancel all active jobs for a page, or for every page of a class
+        if given a class name.
         """
         LOGGER.debug(f"Cancelling jobs for page {page}")
         if isinstance(page, str):
-            name = page
+            pages = [p for p in self._tasks if p.__class__.__name__ == page]
         elif isinstance(page, Page):
-            name = page.__class__.__name__
+            pages = [page]
         else:
             raise TypeError("Page must be either a Page instance or str")
 
-        async with self._lock:
-            tasks = self._tasks.pop(name)
-
-            for task in tasks:
-                task.cancel()
+        for p in pages:
+            self._cancel_tasks(p)
 
     async def pop(self):
         """
@@ -148,21 +318,31 @@ class PageStack:
         associated with this page.
         """
         LOGGER.debug(f"Popping active page from stack")
-        async with self._lock:
-            if len(self._stack) > 1:
-                page = self._stack.pop()
+        with tracing.span("stack_pop"):
+            pages = self._snapshot.pages
+            if len(pages) > 1:
+                self._replace(pages[:-1])
             else:
                 # Cannot remove root page
                 LOGGER.warning("Cannot remove root page from stack")
-                return
 
-        await self.cancel_jobs_for_page(page)
-        
     async def pop_all(self, bottom=1):
         """
         Pop all pages back to the root page.
+
+        All the pages above the bottom are removed in a single change,
+        so no page between them is ever active.
         """
         LOGGER.debug("Popping all pages from stack")
-        async with self._lock:
-            while len(self._stack) > bottom:
-                await self.pop()
+        with tracing.span("stack_pop"):
+            pages = self._snapshot.pages
+            if len(pages) > bottom:
+                self._replace(pages[:max(bottom, 1)])
+
+    def stop(self):
+        """
+        Stop the heartbeats and background jobs of all pages.
+        """
+        self._heartbeats.stop()
+        for page in list(self._tasks):
+            self._cancel_tasks(page)
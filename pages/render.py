@@ -0,0 +1,292 @@
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import multiprocessing
+import os
+
+from typing import TYPE_CHECKING, Any, Callable, Dict, NamedTuple, Optional, Tuple
+if TYPE_CHECKING:
+    from PIL import ImageFont
+
+from .diskcache import DiskCache, default_cache_dir, file_signature
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+RENDER_POOL_ENV = "STREAMDECK_RENDER_POOL"
+RENDER_WORKERS_ENV = "STREAMDECK_RENDER_WORKERS"
+NO_DISK_CACHE_ENV = "STREAMDECK_NO_DISK_CACHE"
+
+# Increment when a change to the rendering functions changes the
+# rendered images, so stale images in the disk cache are not used.
+RENDER_VERSION = 1
+
+
+_RENDER_POOL: "Optional[concurrent.futures.Executor]" = None
+_DISK_CACHE: "Optional[DiskCache]" = None
+
+
+class KeyFormat(NamedTuple):
+    """
+    Image format of the keys of a deck.
+
+    This stands in for the deck when rendering images, so rendering
+    functions can run in a worker process where the deck itself is not
+    available. It provides the `key_image_format` method that the
+    PILHelper functions use.
+    """
+    size: Tuple[int, int]
+    format: str
+    flip: Tuple[bool, bool]
+    rotation: int
+
+    @classmethod
+    def from_deck(cls, deck) -> "KeyFormat":
+        fmt = deck.key_image_format()
+        return cls(
+            tuple(fmt["size"]),
+            fmt["format"],
+            tuple(fmt["flip"]),
+            fmt["rotation"]
+        )
+
+    def key_image_format(self) -> Dict[str, Any]:
+        return {
+            "size": self.size,
+            "format": self.format,
+            "flip": self.flip,
+            "rotation": self.rotation
+        }
+
+
+def create_render_pool() -> concurrent.futures.Executor:
+    """
+    Create the render pool configured by the environment.
+
+    STREAMDECK_RENDER_POOL selects a "thread" (default) or "process"
+    pool, and STREAMDECK_RENDER_WORKERS sets the number of workers.
+    """
+    kind = os.environ.get(RENDER_POOL_ENV, "thread")
+    workers = os.environ.get(RENDER_WORKERS_ENV)
+    max_workers = int(workers) if workers else os.cpu_count()
+
+    LOGGER.info(f"Creating {kind} render pool with {max_workers} workers")
+    if kind == "process":
+        # Spawn rather than fork, the parent has USB writer threads
+        # running that must not be duplicated.
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    elif kind == "thread":
+        return concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="render"
+        )
+    raise ValueError(f"Unknown render pool type {kind}")
+
+
+def get_render_pool() -> concurrent.futures.Executor:
+    """
+    Get the pool used to render key images, creating it if necessary.
+    """
+    global _RENDER_POOL
+    if _RENDER_POOL is None:
+        _RENDER_POOL = create_render_pool()
+    return _RENDER_POOL
+
+
+def set_render_pool(pool: "Optional[concurrent.futures.Executor]"):
+    """
+    Replace the pool used to render key images.
+
+    The previous pool is shut down without waiting for pending renders.
+    Passing None resets to the pool configured by the environment.
+    """
+    global _RENDER_POOL
+    old, _RENDER_POOL = _RENDER_POOL, pool
+    if old is not None and old is not pool:
+        old.shutdown(wait=False)
+
+
+async def run_in_pool(func: Callable, *args):
+    """
+    Run a rendering function in the render pool.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_render_pool(), func, *args)
+
+
+def get_disk_cache() -> Optional[DiskCache]:
+    """
+    Get the on-disk render cache, or None if it is disabled.
+
+    Setting STREAMDECK_NO_DISK_CACHE disables the cache.
+    """
+    global _DISK_CACHE
+    if NO_DISK_CACHE_ENV in os.environ:
+        return None
+    if _DISK_CACHE is None:
+        _DISK_CACHE = DiskCache(default_cache_dir())
+    return _DISK_CACHE
+
+
+def set_disk_cache(disk_cache: Optional[DiskCache]):
+    """
+    Replace the on-disk render cache.
+
+    Passing None resets to the cache configured by the environment.
+    This only affects the current process, so it should not be used
+    with a process render pool.
+    """
+    global _DISK_CACHE
+    _DISK_CACHE = disk_cache
+
+
+def _cached_render(key_parts: Tuple, func: Callable, *args) -> bytes:
+    """
+    Render an image through the on-disk cache.
+    """
+    if (disk_cache := get_disk_cache()) is None:
+        return func(*args)
+
+    key = disk_cache.key(RENDER_VERSION, *key_parts)
+    if (data := disk_cache.get(key)) is not None:
+        LOGGER.debug(f"Loaded {key_parts} from disk cache")
+        return data
+
+    data = func(*args)
+    disk_cache.put(key, data)
+    return data
+
+
+@functools.lru_cache(maxsize=None)
+def load_font(font_path: str, size: int) -> "ImageFont.ImageFont":
+    """
+    Load the font from file with the given size.
+
+    Fonts are cached in each worker. If the font file is missing, the
+    default PIL font is used instead so the keys are still labelled.
+    """
+    from PIL import ImageFont
+
+    if not os.path.isfile(font_path):
+        LOGGER.warning(f"Font {font_path} cannot be found, using default font")
+        return ImageFont.load_default()
+    return ImageFont.truetype(font_path, size)
+
+
+def render_key_image(key_format: KeyFormat,
+                     icon_path: Optional[str],
+                     label: Optional[str],
+                     font_path: str) -> bytes:
+    """
+    Render an icon with optional label into the native key format.
+
+    Images are loaded from the disk cache if the icon, label, font and
+    key format are unchanged since they were last rendered.
+    """
+    key_parts = (
+        "key",
+        key_format,
+        file_signature(icon_path),
+        label,
+        file_signature(font_path) if label else None
+    )
+    return _cached_render(
+        key_parts,
+        _render_key_image,
+        key_format,
+        icon_path,
+        label,
+        font_path
+    )
+
+
+def _render_key_image(key_format: KeyFormat,
+                      icon_path: Optional[str],
+                      label: Optional[str],
+                      font_path: str) -> bytes:
+    """
+    Render an icon with optional label into the native key format.
+
+    This function code is based on the render helper function from the
+    python-elgato-streamdeck example code.
+
+    Missing icons are not rendered.
+    """
+    # PIL is imported when first rendering, images from the bundle or
+    # the disk cache are displayed without loading it.
+    from PIL import Image, ImageDraw
+    from StreamDeck.ImageHelpers import PILHelper
+
+    image = PILHelper.create_image(key_format)
+
+    if icon_path:
+        if os.path.isfile(icon_path):
+            LOGGER.info(f"Rendering icon {icon_path}")
+            icon_image = Image.open(icon_path).convert("RGBA")
+            icon_image.thumbnail((image.width, image.height - 20), Image.LANCZOS)
+            icon_pos = ((image.width - icon_image.width) // 2, 0)
+            image.paste(icon_image, icon_pos, icon_image)
+        else:
+            LOGGER.warning(f"Icon {icon_path} cannot be found")
+
+    if label:
+        LOGGER.debug("Getting font and rendering label")
+        draw = ImageDraw.Draw(image)
+        font = load_font(font_path, 14)
+        label_w, _ = draw.textsize(label, font=font)
+        label_pos = ((image.width - label_w) // 2, image.height - 20)
+        draw.text(label_pos, text=label, font=font, fill="white")
+
+    return PILHelper.to_native_format(key_format, image)
+
+
+def render_number_image(key_format: KeyFormat,
+                        number: int,
+                        font_path: str,
+                        size: int) -> bytes:
+    """
+    Render a two digit number into the native key format.
+
+    Images are loaded from the disk cache if the font and key format
+    are unchanged since they were last rendered.
+    """
+    key_parts = ("number", key_format, number, file_signature(font_path), size)
+    return _cached_render(
+        key_parts,
+        _render_number_image,
+        key_format,
+        number,
+        font_path,
+        size
+    )
+
+
+def _render_number_image(key_format: KeyFormat,
+                         number: int,
+                         font_path: str,
+                         size: int) -> bytes:
+    """
+    Render a two digit number into the native key format.
+    """
+    from PIL import ImageDraw
+    from StreamDeck.ImageHelpers import PILHelper
+
+    LOGGER.info(f"Rendering number {number}")
+    image = PILHelper.create_image(key_format)
+
+    text = f"{number:02d}"
+
+    font = load_font(font_path, size)
+    draw = ImageDraw.Draw(image)
+    w, _h = draw.textsize(text, font=font)
+
+    h_pos = image.height // 8
+    pos = ((image.width - w) // 2, h_pos)
+    draw.text(pos, text=text, font=font, fill="white")
+
+    return PILHelper.to_native_format(key_format, image)
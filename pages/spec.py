@@ -0,0 +1,336 @@
+"""
+Pages defined declaratively in spec files.
+
+A spec file is a JSON or TOML file in the "pages" directory of the
+asset path. The page takes the name of the file, so files only need to
+be read when the page is first navigated to. For example,
+``MediaPage.toml``::
+
+    deck_type = "StreamDeckMini"
+
+    [buttons.1]
+    label = "Steam"
+    icon = "steam_tray.ico"
+    action = { shell = "steam" }
+
+    [buttons.2]
+    label = "Clock"
+    icon = "clock.png"
+    action = { page = "ClockPage" }
+    long_action = "root"
+
+    [buttons.6]
+    label = "Back"
+    icon = "close.png"
+    action = "back"
+
+Labels and icons can be given per state as tables, indexed by the page
+attribute named by ``state``. A spec can extend a page class defined in
+code with ``base``, which is how a spec page gets state, for instance
+``base = "MainPage"`` with ``state = "obs_state"``.
+
+Actions are one of:
+
+- ``{ shell = "cmd" }``: run a shell command
+- ``{ exec = ["program", "arg", ...] }``: start a program
+- ``{ page = "Name" }``: open a page
+- ``"back"``: return to the previous page, or the root on long press
+- ``"previous"``: return to the previous page
+- ``"root"``: return to the root page
+
+Compiled page classes are cached by the hash of the spec file, so a
+page is compiled once and recompiled only when its file changes.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import pathlib
+
+from typing import Any, Dict, Optional, Tuple, Type
+
+from .base import Page, PAGE_REGISTRY, create_action_method, load_page
+from .commands import BackAction, launch_process, launch_shell
+
+try:
+    import tomllib
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+SPEC_SUFFIXES = (".json", ".toml")
+
+
+class SpecError(ValueError):
+    """
+    Raised when a spec file is invalid.
+    """
+
+
+class SpecPage(Page):
+    """
+    Base class for pages compiled from spec files.
+
+    Renders the icon and label of every key of the deck, selecting the
+    variant for the current state where they are given per state.
+    """
+
+    # Name of the page attribute selecting label and icon variants
+    state_attribute: Optional[str] = None
+
+    def _variant(self, value, state):
+        if isinstance(value, dict):
+            return value.get(state)
+        return value
+
+    async def _state(self):
+        if self.state_attribute is None:
+            return None
+        async with self._lock:
+            return getattr(self, self.state_attribute, None)
+
+    async def render_key(self, key):
+        state = await self._state()
+        return await self.render_image_from_file(
+            self._variant(getattr(self, f"button_{key + 1}_icon", None), state),
+            self._variant(getattr(self, f"button_{key + 1}_label", None), state)
+        )
+
+    async def render(self):
+        return await asyncio.gather(*(
+            self.render_key(key)
+            for key in range(self.controller.deck.key_count())
+        ))
+
+    def state_keys(self, name, keys):
+        # Keys with a variant per state depend on the state attribute
+        if name != self.state_attribute:
+            return keys
+        return frozenset(
+            key for key in range(self.controller.deck.key_count())
+            if isinstance(getattr(self, f"button_{key + 1}_icon", None), dict)
+            or isinstance(getattr(self, f"button_{key + 1}_label", None), dict)
+        )
+
+
+def _page_action(name: str):
+    async def open_page(self):
+        LOGGER.info(f"Loading page {name}")
+        await self.controller.set_next_page(name)
+    open_page.__name__ = f"open_{name}"
+    return open_page
+
+
+async def _return_to_previous(self):
+    await self.controller.return_to_previous_page()
+
+
+async def _return_to_root(self):
+    await self.controller.return_to_root()
+
+
+def compile_action(action, long_press: bool = False):
+    """
+    Create the action method for an action of a spec.
+    """
+    if action == "back":
+        back = BackAction()
+        return back.long_press() if long_press else back.short_press()
+    if action == "previous":
+        return _return_to_previous
+    if action == "root":
+        return _return_to_root
+
+    if not isinstance(action, dict) or len(action) != 1:
+        raise SpecError(f"Invalid action {action!r}")
+
+    (kind, value), = action.items()
+    if kind == "shell":
+        if not str(value).strip():
+            raise SpecError("shell action needs a command")
+        return create_action_method(launch_shell, str(value))
+    if kind == "exec":
+        argv = [value] if isinstance(value, str) else list(value)
+        if not argv or not argv[0]:
+            raise SpecError("exec action needs a program")
+        return create_action_method(launch_process, *argv)
+    if kind == "page":
+        return _page_action(str(value))
+    raise SpecError(f"Unknown action type {kind!r}")
+
+
+def compile_spec(spec: Dict[str, Any], name: str) -> Type[Page]:
+    """
+    Compile a parsed spec into a page class.
+    """
+    bases = (SpecPage,)
+    if (base_name := spec.get("base")) is not None:
+        if not isinstance(base_name, str):
+            raise SpecError(f"base must be a page name, not {base_name!r}")
+        if (base := load_page(base_name)) is None:
+            raise SpecError(f"Unknown base page {base_name!r}")
+        if not issubclass(base, SpecPage):
+            bases = (SpecPage, base)
+        else:
+            bases = (base,)
+
+    ns: Dict[str, Any] = {
+        "__doc__": spec.get("description", f"Page compiled from spec {name}"),
+        "__module__": __name__,
+    }
+    for attr in ("deck_type", "label_font", "pressed_threshold", "heartbeat_time",
+                 "loaded_heartbeat_time"):
+        if attr in spec:
+            ns[attr] = spec[attr]
+    if "state" in spec:
+        ns["state_attribute"] = spec["state"]
+
+    buttons = spec.get("buttons", {})
+    if not isinstance(buttons, dict):
+        raise SpecError("buttons must be a table keyed by button number")
+
+    targets = []
+    for number, button in buttons.items():
+        try:
+            n = int(number)
+        except ValueError:
+            raise SpecError(f"Invalid button number {number!r}") from None
+
+        if not isinstance(button, dict):
+            raise SpecError(f"Button {number} must be a table")
+        for attr in ("label", "icon"):
+            if attr not in button:
+                continue
+            if not isinstance(value := button[attr], (str, dict, type(None))):
+                raise SpecError(
+                    f"Button {number} {attr} must be a string or a table "
+                    f"keyed by state, not {value!r}"
+                )
+            ns[f"button_{n}_{attr}"] = value
+        if (action := button.get("action")) is not None:
+            ns[f"button_{n}"] = compile_action(action)
+            if action == "back" and "long_action" not in button:
+                ns[f"alt_button_{n}"] = compile_action(action, long_press=True)
+        if (long_action := button.get("long_action")) is not None:
+            ns[f"alt_button_{n}"] = compile_action(long_action, long_press=True)
+
+        for a in (action, long_action):
+            if isinstance(a, dict) and "page" in a and a["page"] not in targets:
+                targets.append(str(a["page"]))
+
+    if targets:
+        ns["navigation_targets"] = tuple(targets)
+
+    return type(Page)(name, bases, ns)
+
+
+def parse_spec(path: pathlib.Path, data: bytes) -> Dict[str, Any]:
+    """
+    Parse the contents of a spec file.
+    """
+    if path.suffix == ".toml" and tomllib is None:
+        raise SpecError("TOML specs need Python 3.11 or tomli installed")
+
+    try:
+        if path.suffix == ".toml":
+            spec = tomllib.loads(data.decode("utf-8"))
+        else:
+            spec = json.loads(data)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise SpecError(f"Cannot parse spec {path}: {e}") from e
+
+    if not isinstance(spec, dict):
+        raise SpecError(f"Spec {path} must be a table")
+    return spec
+
+
+class SpecLoader:
+    """
+    Finds spec files and compiles them into page classes on demand.
+    """
+
+    _compiled: Dict[Tuple[str, str], Type[Page]]
+
+    def __init__(self, path: Optional[pathlib.Path] = None):
+        self._path = path
+        self._compiled = {}
+
+    @property
+    def path(self) -> pathlib.Path:
+        return self._path or Page.asset_path / "pages"
+
+    def find(self, name: str) -> Optional[pathlib.Path]:
+        """
+        Find the spec file for a page name.
+        """
+        for suffix in SPEC_SUFFIXES:
+            if (path := self.path / f"{name}{suffix}").is_file():
+                return path
+        return None
+
+    def names(self):
+        """
+        Names of all the spec files, without reading them.
+        """
+        if not self.path.is_dir():
+            return []
+        return sorted(
+            path.stem for path in self.path.iterdir()
+            if path.suffix in SPEC_SUFFIXES
+        )
+
+    def read(self, name: str):
+        """
+        Read the spec file for a page, returns the path, hash and data.
+        """
+        if (path := self.find(name)) is None:
+            return None
+        data = path.read_bytes()
+        return path, hashlib.sha256(data).hexdigest(), data
+
+    def compile(self, path: pathlib.Path, digest: str, data: bytes) -> Type[Page]:
+        """
+        Compile a spec, reusing the class compiled for the same name
+        and contents.
+        """
+        if (page_class := self._compiled.get((path.stem, digest))) is not None:
+            LOGGER.debug(f"Using compiled page for spec {path}")
+            # Put the page back in the registry, another spec with the
+            # same name may have replaced it.
+            PAGE_REGISTRY[page_class.__name__] = page_class
+            return page_class
+
+        LOGGER.info(f"Compiling page spec {path}")
+        page_class = compile_spec(parse_spec(path, data), path.stem)
+        self._compiled[path.stem, digest] = page_class
+        return page_class
+
+    async def load(self, name: str) -> Optional[Type[Page]]:
+        """
+        Load the page class for a page name from its spec file.
+        """
+        loop = asyncio.get_running_loop()
+        if (found := await loop.run_in_executor(None, self.read, name)) is None:
+            return None
+        return self.compile(*found)
+
+    def load_all(self):
+        """
+        Compile every spec file, used when building the asset bundle.
+        """
+        for name in self.names():
+            if (found := self.read(name)) is not None:
+                try:
+                    self.compile(*found)
+                except SpecError as e:
+                    LOGGER.error(str(e))
+
+
+SPEC_LOADER = SpecLoader()
@@ -1,26 +1,40 @@
 #!/usr/local/bin/python3.8
 
+import argparse
 import asyncio
 from contextlib import asynccontextmanager
 import logging
 import os
+import pathlib
 import sys
 from subprocess import DEVNULL
 import traceback
 import signal
 
-from StreamDeck.DeviceManager import DeviceManager
+from typing import Dict
 
+# Profiling must start before the modules it should time are imported
+import importprofile
+importprofile.configure_from_env()
+
+import tracing
 from controller import Controller
+from devicewatch import DeviceWatcher
+from pages import warm_up
 
 
-MAIN_LOOP_SLEEP = 60
+# Seconds to wait for a deck to be set up before giving up on it
+DECK_SETUP_TIMEOUT = 30
 
 LOGGER = logging.getLogger(__name__)
 
 
+# Controllers, keyed by deck serial number so they survive replugging
 DECKS = {} # type: ignore
 
+# Serial number of the deck attached at each device id
+ATTACHED: Dict[str, str] = {}
+
 
 def make_sigterm_cb(decks):
 
@@ -32,37 +46,150 @@ def make_sigterm_cb(decks):
     return func
 
 
-@asynccontextmanager
-async def setup_decks():
-    LOGGER.info("Setting up stream decks")
-    devices = DeviceManager().enumerate()
+def deck_serial(deck) -> str:
+    """
+    Get an identifier for a deck that stays the same across replugs.
+
+    The device id is the path of the device, which changes when the
+    deck is plugged into another port, so the serial number is used
+    where the deck has one.
+    """
+    try:
+        return deck.get_serial_number()
+    except Exception:
+        return deck.id()
 
-    LOGGER.info(f"Found {len(devices)} stream decks")
 
-    for deck in devices:
+async def setup_deck(deck):
+    """
+    Open a deck, attach its controller and paint the current page.
 
-        deck.open()
-        deck.reset()
+    A deck that was set up before is given its previous controller,
+    so its pages and render caches are still warm.
+    """
+    loop = asyncio.get_running_loop()
 
-        if (i_d:=deck.id()) in DECKS:
-            controller = DECKS[i_d]
-        else:
-            controller = Controller(deck)
-            DECKS[i_d] = controller 
+    # Opening and resetting the deck are blocking USB operations
+    await loop.run_in_executor(None, deck.open)
+    await loop.run_in_executor(None, deck.reset)
+    serial = await loop.run_in_executor(None, deck_serial, deck)
 
+    if (controller := DECKS.get(serial)) is not None:
+        LOGGER.info(f"Reattaching deck {serial}")
+        controller.attach(deck)
+        deck.set_key_callback_async(controller)
+    else:
+        controller = Controller(deck)
         deck.set_key_callback_async(controller)
-        await controller.setup()
-        await controller.update_deck()
+        try:
+            await controller.setup()
+        except BaseException:
+            # Leave no controller behind, a retry sets the deck up afresh
+            controller.detach()
+            raise
+        DECKS[serial] = controller
+
+    ATTACHED[deck.id()] = serial
+    # Paint before connecting pages to external services, so the deck
+    # lights up straight away even if a service is down.
+    await controller.update_deck()
+    controller.start()
+
+
+async def setup_deck_isolated(deck) -> bool:
+    """
+    Set up a deck, containing any failure to that deck.
+
+    A deck that raises or takes longer than DECK_SETUP_TIMEOUT is
+    logged and closed, so it cannot stop the other decks being set up
+    and can be opened again when it is retried. Returns whether the
+    deck was set up.
+    """
+    try:
+        await asyncio.wait_for(setup_deck(deck), DECK_SETUP_TIMEOUT)
+    except asyncio.TimeoutError:
+        LOGGER.error(f"Timed out setting up deck {deck.id()}")
+    except asyncio.CancelledError:
+        # The deck was unplugged while it was being set up
+        release_deck(deck)
+        raise
+    except Exception:
+        LOGGER.exception(f"Failed to set up deck {deck.id()}")
+    else:
+        LOGGER.info(f"Deck {deck.id()} ready")
+        return True
+    release_deck(deck)
+    return False
+
+
+def release_deck(deck):
+    """
+    Close a deck that could not be set up.
+    """
+    if (serial := ATTACHED.pop(deck.id(), None)) is not None:
+        if (controller := DECKS.get(serial)) is not None and controller.deck is deck:
+            # Also stops the writer of the controller
+            controller.detach()
+            return
+    try:
+        deck.close()
+    except Exception as e:
+        LOGGER.debug(f"Closing deck {deck.id()}: {e}")
+
+
+async def detach_deck(device_id: str):
+    """
+    Detach the controller of an unplugged deck, keeping it for replug.
+    """
+    if (serial := ATTACHED.pop(device_id, None)) is None:
+        return
+    if (controller := DECKS.get(serial)) is not None:
+        LOGGER.info(f"Detaching deck {serial}")
+        controller.detach()
+
+
+@asynccontextmanager
+async def setup_decks():
+    LOGGER.info("Setting up stream decks")
+    watcher = DeviceWatcher(setup_deck_isolated, detach_deck)
+
+    # The decks connected at startup are set up concurrently, so
+    # startup takes as long as the slowest deck rather than the sum
+    # of all of them.
+    count = await watcher.scan(wait=True)
+    LOGGER.info(f"Set up {count} stream decks")
+
+    if importprofile.enabled():
+        print(f"First frame after {importprofile.since_start() * 1000:.0f}ms",
+              file=sys.stderr)
+        print(importprofile.report(), file=sys.stderr, flush=True)
+
+    # Load the other pages now the decks are lit, so they are ready
+    # before they are first opened
+    warmup = asyncio.ensure_future(warm_up())
 
     try:
-        yield devices
+        yield watcher
     except:
         raise
     finally:
+        warmup.cancel()
         LOGGER.info("Closing stream decks")
-        for deck in devices:
-            deck.reset()
-            deck.close()
+        for serial, controller in DECKS.items():
+            try:
+                controller.shutdown()
+            except Exception:
+                LOGGER.exception(f"Failed to close deck {serial}")
+
+
+def dump_trace_stats():
+    """
+    Print the press latency histograms, on SIGUSR1.
+    """
+    if not tracing.enabled():
+        LOGGER.warning("Tracing is off, set STREAMDECK_TRACE to enable it")
+        return
+    print(tracing.STATS.dump(), file=sys.stderr, flush=True)
 
 
 def exception_handler(loop, context):
@@ -80,26 +207,54 @@ async def main():
     sigterm_cb = make_sigterm_cb(DECKS)
     loop.add_signal_handler(signal.SIGTERM, sigterm_cb)
     loop.add_signal_handler(signal.SIGINT, sigterm_cb)
-
-    async with setup_decks():
-        while True:
-
-            await asyncio.sleep(MAIN_LOOP_SLEEP)
-
-            
-
-
-
-
-
-
-    
-
-
-
-
-
-
+    loop.add_signal_handler(signal.SIGUSR1, dump_trace_stats)
+
+    async with setup_decks() as watcher:
+        # Decks plugged in later are attached as they appear
+        await watcher.run()
+
+
+def build_assets(args):
+    """
+    Compile the images of all registered pages into the asset bundle.
+    """
+    from pages import Page
+    from pages.base import PAGE_REGISTRY, load_pages
+    from pages.bundle import BUNDLE_NAME, build_bundle
+    from pages.spec import SPEC_LOADER
+
+    load_pages()
+    SPEC_LOADER.load_all()
+    path = args.output or Page.asset_path / BUNDLE_NAME
+    count = build_bundle(PAGE_REGISTRY.values(), path, args.deck_type)
+    print(f"Wrote {count} images to {path}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Stream Deck controller")
+    commands = parser.add_subparsers(dest="command")
+
+    commands.add_parser("run", help="Control the connected decks (default)")
+
+    build = commands.add_parser(
+        "build-assets",
+        help="Compile the icons and labels of all pages, including spec "
+             "pages, into an asset bundle"
+    )
+    build.add_argument(
+        "-o", "--output",
+        type=pathlib.Path,
+        help="Path of the bundle, defaults to the asset directory"
+    )
+    build.add_argument(
+        "-d", "--deck-type",
+        action="append",
+        help="Deck type to compile for, e.g. StreamDeckXL. "
+             "May be given more than once. Defaults to the deck type "
+             "of each page"
+    )
+
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
@@ -107,4 +262,10 @@ if __name__ == "__main__":
     level = logging.DEBUG if debug else logging.WARNING
 
     logging.basicConfig(level=level)
-    asyncio.run(main())
+    tracing.configure_from_env()
+
+    args = parse_args()
+    if args.command == "build-assets":
+        build_assets(args)
+    else:
+        asyncio.run(main())
@@ -0,0 +1,346 @@
+"""
+Tracing of key presses through the dispatch pipeline.
+
+Each key press starts a trace, and the time spent in the stages of the
+pipeline (dispatch, the action, page stack changes, rendering, waiting
+for a frame and the USB write) is recorded as spans of that trace.
+Durations are collected into histograms for each span name, page and
+button, and the time from the press until its images were written to
+the deck is recorded as "press_to_pixel".
+
+Tracing is off by default and costs a single check per span when off.
+Set STREAMDECK_TRACE to enable it, and STREAMDECK_TRACE_FILE to also
+export every span as a line of OpenTelemetry style JSON to a file.
+"""
+
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+TRACE_ENV = "STREAMDECK_TRACE"
+TRACE_FILE_ENV = "STREAMDECK_TRACE_FILE"
+
+# Number of samples kept for each histogram
+HISTOGRAM_SIZE = 2048
+
+
+_ENABLED = False
+_EXPORTER: "Optional[FileExporter]" = None
+
+# Offset from the performance counter to the unix epoch, in ns
+_EPOCH_OFFSET = time.time_ns() - time.perf_counter_ns()
+
+_CURRENT: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+class Span:
+    """
+    A timed stage of a trace.
+
+    Spans inherit the page and button attributes of their parent, so
+    every stage of a press is attributed to the page and button.
+    """
+    __slots__ = ("name", "trace_id", "span_id", "parent", "attributes",
+                 "start", "end")
+
+    def __init__(self, name: str, parent: "Optional[Span]" = None,
+                 attributes: Optional[Dict[str, Any]] = None,
+                 start: Optional[int] = None):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else random.getrandbits(128)
+        self.span_id = random.getrandbits(64)
+        self.attributes = {}
+        if parent is not None:
+            for attr in ("page", "button"):
+                if attr in parent.attributes:
+                    self.attributes[attr] = parent.attributes[attr]
+        if attributes:
+            self.attributes.update(attributes)
+        self.start = time.perf_counter_ns() if start is None else start
+        self.end: Optional[int] = None
+
+    @property
+    def root(self) -> "Span":
+        span = self
+        while span.parent is not None:
+            span = span.parent
+        return span
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self, end: Optional[int] = None):
+        self.end = time.perf_counter_ns() if end is None else end
+        STATS.record(self.name, self.attributes, self.end - self.start)
+        if _EXPORTER is not None:
+            _EXPORTER.export(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "traceId": f"{self.trace_id:032x}",
+            "spanId": f"{self.span_id:016x}",
+            "parentSpanId": f"{self.parent.span_id:016x}" if self.parent else "",
+            "name": self.name,
+            "startTimeUnixNano": self.start + _EPOCH_OFFSET,
+            "endTimeUnixNano": (self.end or self.start) + _EPOCH_OFFSET,
+            "attributes": [
+                {"key": key, "value": {"stringValue": str(value)}}
+                for key, value in self.attributes.items()
+            ],
+        }
+
+
+class _NoSpan:
+    """
+    Stand in for a span when tracing is off.
+    """
+
+    def set(self, **attributes):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _NoopContext:
+    def __enter__(self):
+        return _NO_SPAN
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NOOP_CONTEXT = _NoopContext()
+
+
+class Histogram:
+    """
+    Reservoir of recent durations for a span, in ns.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.samples: Deque[int] = deque(maxlen=HISTOGRAM_SIZE)
+
+    def add(self, duration: int):
+        self.count += 1
+        self.samples.append(duration)
+
+    def percentiles(self, *ps: float) -> List[float]:
+        """
+        Get percentiles of the recent durations, in milliseconds.
+        """
+        samples = sorted(self.samples)
+        if not samples:
+            return [0.0 for _ in ps]
+        n = len(samples)
+        return [samples[min(n - 1, int(n * p / 100))] / 1e6 for p in ps]
+
+
+class TraceStats:
+    """
+    Duration histograms for each span name, page and button.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, str, str], Histogram] = defaultdict(Histogram)
+
+    def record(self, name: str, attributes: Dict[str, Any], duration: int):
+        key = (
+            name,
+            str(attributes.get("page", "")),
+            str(attributes.get("button", ""))
+        )
+        with self._lock:
+            self._histograms[key].add(duration)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """
+        Get p50, p95 and p99 durations for every span, page and button.
+        """
+        with self._lock:
+            items = sorted(self._histograms.items())
+        rows = []
+        for (name, page, button), histogram in items:
+            p50, p95, p99 = histogram.percentiles(50, 95, 99)
+            rows.append({
+                "span": name,
+                "page": page,
+                "button": button,
+                "count": histogram.count,
+                "p50_ms": p50,
+                "p95_ms": p95,
+                "p99_ms": p99,
+            })
+        return rows
+
+    def dump(self) -> str:
+        """
+        Format the summary as a table.
+        """
+        lines = [
+            f"{'span':<16} {'page':<20} {'button':>6} {'count':>7} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        ]
+        for row in self.summary():
+            lines.append(
+                f"{row['span']:<16} {row['page']:<20} {row['button']:>6} "
+                f"{row['count']:>7} {row['p50_ms']:>8.2f} "
+                f"{row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f}"
+            )
+        return "\n".join(lines)
+
+
+STATS = TraceStats()
+
+
+class FileExporter:
+    """
+    Writes finished spans to a file, one JSON object per line.
+
+    Spans use the field names of the OpenTelemetry JSON encoding, so
+    they can be loaded by standard tools without a collector.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict())
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def enable(export_path: Optional[str] = None):
+    """
+    Turn tracing on, optionally exporting spans to a file.
+    """
+    global _ENABLED, _EXPORTER
+    _ENABLED = True
+    if export_path is not None:
+        if _EXPORTER is not None:
+            _EXPORTER.close()
+        _EXPORTER = FileExporter(export_path)
+
+
+def disable():
+    global _ENABLED, _EXPORTER
+    _ENABLED = False
+    if _EXPORTER is not None:
+        _EXPORTER.close()
+        _EXPORTER = None
+
+
+def enabled() -> bool:
+    return _ENABLED
+
+
+def configure_from_env():
+    """
+    Enable tracing if STREAMDECK_TRACE is set.
+    """
+    if TRACE_ENV in os.environ:
+        enable(os.environ.get(TRACE_FILE_ENV))
+
+
+def current_span() -> Optional[Span]:
+    """
+    Get the span of the current context, None if there is none.
+    """
+    if not _ENABLED:
+        return None
+    return _CURRENT.get()
+
+
+@contextlib.contextmanager
+def _span(name: str, attributes: Dict[str, Any]):
+    span = Span(name, _CURRENT.get(), attributes)
+    token = _CURRENT.set(span)
+    try:
+        yield span
+    finally:
+        _CURRENT.reset(token)
+        span.finish()
+
+
+def span(name: str, **attributes):
+    """
+    Context manager timing a stage as a child of the current span.
+
+    This starts a new trace if there is no current span.
+    """
+    if not _ENABLED:
+        return _NOOP_CONTEXT
+    return _span(name, attributes)
+
+
+def record_span(name: str, parents: Iterable[Span], start: int, end: int,
+                **attributes):
+    """
+    Record a stage that ran outside the context of the traces it
+    belongs to, such as a frame rendered for several requests.
+    """
+    for parent in parents:
+        span = Span(name, parent, attributes, start)
+        span.finish(end)
+
+
+class FrameTrace:
+    """
+    Follows the traces of a frame until its keys are written.
+
+    The USB write of each key is recorded as a span of every trace
+    that requested the frame. When the last key of the frame has been
+    written, the time since the start of each trace is recorded as
+    "press_to_pixel".
+    """
+
+    def __init__(self, spans: List[Span], keys: int):
+        self.spans = spans
+        self._remaining = keys
+        self._lock = threading.Lock()
+
+    def key_done(self, key: int, start: Optional[int] = None,
+                 end: Optional[int] = None):
+        """
+        Mark a key of the frame as written, or as needing no write.
+        """
+        if start is not None and end is not None:
+            record_span("usb_write", self.spans, start, end, key=key)
+
+        with self._lock:
+            self._remaining -= 1
+            done = self._remaining == 0
+
+        if done:
+            end = end if end is not None else time.perf_counter_ns()
+            for span in self.spans:
+                root = span.root
+                STATS.record("press_to_pixel", root.attributes, end - root.start)